@@ -1,13 +1,38 @@
 from flask import (
     Flask, render_template, request, redirect,
-    session, send_file
+    session, send_file, send_from_directory, abort, url_for, jsonify, g, Response
 )
 import sqlite3
 import hashlib
+import hmac
 import os
-import shutil
-from datetime import datetime
-from io import BytesIO
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturoVencido
+from datetime import datetime, date
+from io import BytesIO, StringIO
+import random
+import re
+
+import base64
+import calendar
+import click
+import contextvars
+import csv
+import gzip
+import json
+import mimetypes
+import queue
+import secrets
+from collections import OrderedDict
+from urllib.parse import urlencode
+from flask.sessions import (
+    SessionInterface, SessionMixin, SecureCookieSessionInterface,
+    session_json_serializer
+)
+from werkzeug.datastructures import CallbackDict
+from werkzeug.exceptions import NotFound
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
@@ -17,34 +42,406 @@ from reportlab.lib.pagesizes import letter
 # ==============================
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATABASE = os.path.join(BASE_DIR, "cooperativa.db")
+DATABASE = os.environ.get("COOP_DATABASE", os.path.join(BASE_DIR, "cooperativa.db"))
 BACKUP_DIR = os.path.join(BASE_DIR, "backups")
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+ASSETS_DIR = os.path.join(STATIC_DIR, "dist")
+LIMITES_DB = os.environ.get("COOP_LIMITES_DB", os.path.join(BASE_DIR, "limites.db"))
+SESIONES_DB = os.environ.get("COOP_SESIONES_DB", os.path.join(BASE_DIR, "sesiones.db"))
 
 if not os.path.exists(BACKUP_DIR):
     os.makedirs(BACKUP_DIR)
 
-SECRET_KEY = "clave_super_segura_2025"
+# Multi-cooperativa: "" (una sola base, la de arriba), "subdominio"
+# (<tenant>.COOP_TENANT_DOMINIO) o "ruta" (/t/<tenant>/...). Cada tenant
+# vive en TENANTS_DIR/<tenant>/ con su propia base, sesiones y backups.
+TENANT_MODO = os.environ.get("COOP_TENANT_MODO", "")
+TENANT_DOMINIO = os.environ.get("COOP_TENANT_DOMINIO", "")
+TENANTS_DIR = os.environ.get("COOP_TENANTS_DIR", os.path.join(BASE_DIR, "tenants"))
+DB_POOL_MAX = int(os.environ.get("COOP_DB_POOL_MAX", 8))
+
+# Group commit de movimientos: ventana máxima de espera y tamaño de lote.
+ESCRITURA_VENTANA = float(os.environ.get("COOP_ESCRITURA_VENTANA_MS", 5)) / 1000
+ESCRITURA_LOTE_MAX = int(os.environ.get("COOP_ESCRITURA_LOTE_MAX", 256))
+ESCRITURA_TIMEOUT = float(os.environ.get("COOP_ESCRITURA_TIMEOUT", 30))
+
+# Sin COOP_SECRET_KEY se genera una clave aleatoria y se guarda en
+# COOP_SECRET_KEY_ARCHIVO (la comparten todos los workers). Nunca se usa
+# una clave fija: con sesiones "token" permitiría falsificar un admin.
+SECRET_KEY_ARCHIVO = os.environ.get("COOP_SECRET_KEY_ARCHIVO", os.path.join(BASE_DIR, "secret_key"))
+SECRET_KEY_INSEGURAS = {"clave_super_segura_2025"}
+
+
+def cargar_secret_key() -> str:
+    clave = os.environ.get("COOP_SECRET_KEY", "")
+    if clave in SECRET_KEY_INSEGURAS:
+        raise RuntimeError("COOP_SECRET_KEY tiene un valor público; defina una clave propia.")
+    if clave:
+        return clave
+
+    try:
+        fd = os.open(SECRET_KEY_ARCHIVO, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # otro worker pudo haberlo creado recién: se espera a que termine de escribirla
+        for _ in range(50):
+            with open(SECRET_KEY_ARCHIVO, encoding="utf-8") as fh:
+                clave = fh.read().strip()
+            if clave:
+                return clave
+            time.sleep(0.1)
+        raise RuntimeError(f"{SECRET_KEY_ARCHIVO} está vacío; bórrelo o defina COOP_SECRET_KEY.")
+    except OSError as e:
+        raise RuntimeError(f"No se pudo crear {SECRET_KEY_ARCHIVO} ({e}); defina COOP_SECRET_KEY.")
+
+    clave = secrets.token_urlsafe(48)
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        fh.write(clave + "\n")
+    return clave
+
+
+SECRET_KEY = cargar_secret_key()
+
+# Proxies inversos confiables delante de la app (nginx, balanceador). Con 0
+# la IP del cliente es la de la conexión; con N se toma de X-Forwarded-For
+# (la N-ésima desde la derecha), igual que X-Forwarded-Proto. Debe ser
+# exactamente la cantidad real: de más, el cliente puede falsificar su IP;
+# de menos, todos los socios comparten el límite de intentos de login.
+PROXIES_CONFIABLES = int(os.environ.get("COOP_PROXIES_CONFIABLES", 0))
+
+# "sqlite": sesiones en servidor (la cookie sólo lleva un id aleatorio).
+# "token": cookie firmada de Flask, con chequeo de revocación.
+SESION_BACKEND = os.environ.get("COOP_SESION_BACKEND", "sqlite")
+SESION_DURACION = int(os.environ.get("COOP_SESION_DURACION", 8 * 3600))
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
 
 
 # ==============================
-# UTILIDADES
+# TENANTS Y POOL DE CONEXIONES
 # ==============================
 
+TENANT_NOMBRE_RE = re.compile(r"^[a-z0-9][a-z0-9-]{0,39}$")
+
+_tenant_actual = contextvars.ContextVar("tenant", default="")
+
+
+def tenant_actual() -> str:
+    return _tenant_actual.get()
+
+
+def rutas_tenant(tenant=None) -> dict:
+    tenant = tenant_actual() if tenant is None else tenant
+    if not tenant:
+        return {"db": DATABASE, "sesiones": SESIONES_DB, "limites": LIMITES_DB, "backups": BACKUP_DIR}
+    base = os.path.join(TENANTS_DIR, tenant)
+    return {
+        "db": os.path.join(base, "cooperativa.db"),
+        "sesiones": os.path.join(base, "sesiones.db"),
+        "limites": os.path.join(base, "limites.db"),
+        "backups": os.path.join(base, "backups"),
+    }
+
+
+def tenants_existentes():
+    if not os.path.isdir(TENANTS_DIR):
+        return []
+    return sorted(
+        n for n in os.listdir(TENANTS_DIR)
+        if TENANT_NOMBRE_RE.match(n) and os.path.isdir(os.path.join(TENANTS_DIR, n))
+    )
+
+
+def en_tenant(tenant: str, fn, *args):
+    token = _tenant_actual.set(tenant)
+    try:
+        return fn(*args)
+    finally:
+        _tenant_actual.reset(token)
+
+
+def en_todos_los_tenants(fn, *args, workers: int = 8):
+    """Ejecuta fn en cada tenant en paralelo; devuelve {tenant: resultado}."""
+    tenants = tenants_existentes()
+    if not tenants:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(tenants))) as ex:
+        resultados = list(ex.map(lambda t: en_tenant(t, fn, *args), tenants))
+    return dict(zip(tenants, resultados))
+
+
+class ConexionPool(sqlite3.Connection):
+    """Conexión cuyo close() la devuelve al pool de su base."""
+    pool = None
+
+    def close(self):
+        if self.pool is not None and self.pool.devolver(self):
+            return
+        super().close()
+
+
+class PoolConexiones:
+
+    def __init__(self, ruta: str, maximo: int = DB_POOL_MAX):
+        self.ruta = ruta
+        self._libres = queue.LifoQueue(maximo)
+
+    def obtener(self):
+        try:
+            return self._libres.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.ruta, timeout=10, factory=ConexionPool, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.pool = self
+            return conn
+
+    def devolver(self, conn) -> bool:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._libres.put_nowait(conn)
+            return True
+        except queue.Full:
+            return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(ruta: str) -> PoolConexiones:
+    pool = _pools.get(ruta)
+    if pool is None:
+        # Sólo la primera conexión a una base (p. ej. un tenant nuevo)
+        # pasa por el lock y aplica las migraciones; las demás no esperan.
+        with _pools_lock:
+            pool = _pools.get(ruta)
+            if pool is None:
+                pool = PoolConexiones(ruta)
+                inicializar_db(pool.obtener())
+                _pools[ruta] = pool
+    return pool
+
+
 def db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return _pool(rutas_tenant()["db"]).obtener()
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
 
-def inicializar_db():
-    conn = db()
+# ==============================
+# ESCRITURAS AGRUPADAS (GROUP COMMIT)
+# ==============================
+
+# Cada proceso tiene un hilo escritor por base. Las vistas le encolan
+# operaciones fn(cursor); el hilo junta las que lleguen dentro de
+# ESCRITURA_VENTANA y las confirma en una sola transacción (un fsync).
+# Cada operación corre en su propio SAVEPOINT: si una falla sólo se
+# deshace esa. El llamador recibe el resultado recién después del COMMIT.
+# Si se cansa de esperar, la operación se cancela mientras siga en la cola;
+# si ya entró en un lote, el resultado es incierto y así se le informa.
+
+class ErrorEscritura(Exception):
+    """La escritura no llegó a confirmarse; el mensaje dice si se puede reintentar."""
+
+
+class EscrituraNoRealizada(ErrorEscritura):
+    """No se escribió nada: es seguro reintentar."""
+
+
+class EscrituraIncierta(ErrorEscritura):
+    """La operación pudo haberse confirmado: hay que verificar antes de reintentar."""
+
+
+MSG_NO_REALIZADA = "El servidor está ocupado y el movimiento NO se registró; puede reintentar."
+MSG_INCIERTA = ("No se pudo confirmar si el movimiento quedó registrado: "
+                "verifíquelo antes de volver a cargarlo.")
+
+
+class CoordinadorEscrituras:
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.caido = None
+        self._cola = queue.Queue()
+        self._hilo = threading.Thread(target=self._bucle, name="escrituras", daemon=True)
+        self._hilo.start()
+
+    def enviar(self, fn) -> Future:
+        if self.caido is not None:
+            raise EscrituraNoRealizada(MSG_NO_REALIZADA) from self.caido
+        futuro = Future()
+        self._cola.put((fn, futuro))
+        if self.caido is not None:
+            self._vaciar()  # el hilo murió mientras encolábamos
+        return futuro
+
+    def _bucle(self):
+        try:
+            # espera el lock menos que el llamador: una base bloqueada falla
+            # limpia (nada escrito) en vez de dejar el resultado incierto
+            conn = sqlite3.connect(self.ruta, timeout=ESCRITURA_TIMEOUT / 2,
+                                   isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=FULL")
+            while True:
+                lote = [self._cola.get()]
+                limite = time.monotonic() + ESCRITURA_VENTANA
+                while len(lote) < ESCRITURA_LOTE_MAX:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    try:
+                        lote.append(self._cola.get(timeout=restante))
+                    except queue.Empty:
+                        break
+                self._confirmar(conn, lote)
+        except BaseException as e:
+            # sin hilo nadie atiende la cola: se rechaza lo pendiente y
+            # escribir() crea un coordinador nuevo en la próxima llamada
+            self.caido = e
+            self._vaciar()
+            raise
+
+    def _vaciar(self):
+        while True:
+            try:
+                _, futuro = self._cola.get_nowait()
+            except queue.Empty:
+                return
+            if futuro.set_running_or_notify_cancel():
+                error = EscrituraNoRealizada(MSG_NO_REALIZADA)
+                error.__cause__ = self.caido
+                futuro.set_exception(error)
+
+    def _confirmar(self, conn, lote):
+        # Las que el llamador ya abandonó no se ejecutan; las demás quedan
+        # "en curso" y desde ahí no se pueden cancelar.
+        lote = [(fn, futuro) for fn, futuro in lote if futuro.set_running_or_notify_cancel()]
+        if not lote:
+            return
+        resultados = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.cursor()
+            for fn, futuro in lote:
+                cur.execute("SAVEPOINT op")
+                try:
+                    resultados.append((futuro, fn(cur), None))
+                except Exception as e:
+                    cur.execute("ROLLBACK TO op")
+                    resultados.append((futuro, None, e))
+                cur.execute("RELEASE op")
+            conn.execute("COMMIT")
+        except Exception as e:
+            # BEGIN/COMMIT falló: no quedó nada escrito
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            error = EscrituraNoRealizada(MSG_NO_REALIZADA)
+            error.__cause__ = e
+            for _, futuro in lote:
+                futuro.set_exception(error)
+            return
+
+        for futuro, res, error in resultados:
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(res)
+
+
+_coordinadores = {}
+_coordinadores_lock = threading.Lock()
+
+
+def escribir(fn):
+    """Ejecuta fn(cursor) en el próximo lote de escritura y espera el COMMIT.
+
+    Las excepciones de fn llegan tal cual; los problemas del propio lote
+    (timeout, base bloqueada, hilo escritor caído) como ErrorEscritura.
+    """
+    clave = (os.getpid(), rutas_tenant()["db"])  # los hilos no sobreviven a un fork
+    coord = _coordinadores.get(clave)
+    if coord is None or coord.caido is not None:
+        _pool(clave[1])  # asegura el esquema antes de escribir
+        with _coordinadores_lock:
+            coord = _coordinadores.get(clave)
+            if coord is None or coord.caido is not None:
+                coord = _coordinadores[clave] = CoordinadorEscrituras(clave[1])
+
+    futuro = coord.enviar(fn)
+    try:
+        return futuro.result(timeout=ESCRITURA_TIMEOUT)
+    except FuturoVencido:
+        if futuro.cancel():
+            raise EscrituraNoRealizada(MSG_NO_REALIZADA)
+        if not futuro.done():
+            raise EscrituraIncierta(MSG_INCIERTA)
+        return futuro.result()
+
+
+class EnrutadorTenants:
+    """Middleware WSGI: resuelve el tenant de la petición (404 si no existe)."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        tenant = self._resolver(environ)
+        if tenant is None:
+            return NotFound("Cooperativa no encontrada.")(environ, start_response)
+        token = _tenant_actual.set(tenant)
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            _tenant_actual.reset(token)
+
+    def _resolver(self, environ):
+        if TENANT_MODO == "subdominio":
+            host = environ.get("HTTP_HOST", "").split(":")[0].lower()
+            sufijo = "." + TENANT_DOMINIO
+            nombre = host[:-len(sufijo)] if TENANT_DOMINIO and host.endswith(sufijo) else ""
+        elif TENANT_MODO == "ruta":
+            partes = environ.get("PATH_INFO", "").split("/", 3)  # ["", "t", nombre, resto]
+            if len(partes) < 3 or partes[1] != "t":
+                return None
+            nombre = partes[2]
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + "/t/" + nombre
+            environ["PATH_INFO"] = "/" + (partes[3] if len(partes) > 3 else "")
+        else:
+            return ""
+
+        if TENANT_NOMBRE_RE.match(nombre) and os.path.isdir(os.path.join(TENANTS_DIR, nombre)):
+            return nombre
+        return None
+
+
+app.wsgi_app = EnrutadorTenants(app.wsgi_app)
+
+if PROXIES_CONFIABLES:
+    # Por fuera del enrutador: todo lo demás ve la IP y el esquema del cliente.
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIABLES, x_proto=PROXIES_CONFIABLES)
+
+
+@app.after_request
+def prefijar_redirecciones(resp):
+    # Modo "ruta": los redirect("/...") de las vistas quedan dentro del tenant.
+    raiz = request.script_root
+    destino = resp.headers.get("Location")
+    if raiz and destino and destino.startswith("/") and not destino.startswith(raiz + "/"):
+        resp.headers["Location"] = raiz + destino
+    return resp
+
+
+# ==============================
+# UTILIDADES
+# ==============================
+
+def inicializar_db(conn=None):
+    conn = conn or db()
     cur = conn.cursor()
 
+    # WAL: las lecturas no bloquean al escritor (ver ESCRITURAS AGRUPADAS)
+    cur.execute("PRAGMA journal_mode=WAL")
+
     # Tabla de socios (para login web)
     cur.execute("""
     CREATE TABLE IF NOT EXISTS socios_web (
@@ -118,6 +515,75 @@ def inicializar_db():
     )
     """)
 
+    # Cierres de período: saldos y totales por socio al fin de cada mes
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS periodos_cerrados (
+        periodo TEXT PRIMARY KEY,
+        fecha_corte TEXT NOT NULL,
+        socios INTEGER NOT NULL,
+        creado TEXT NOT NULL
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS cierres (
+        periodo TEXT NOT NULL,
+        socio_id INTEGER NOT NULL,
+        saldo_inicial REAL NOT NULL,
+        saldo_final REAL NOT NULL,
+        aportes_periodo REAL NOT NULL,
+        retiros_periodo REAL NOT NULL,
+        prestamos_periodo REAL NOT NULL,
+        pag_principal_periodo REAL NOT NULL,
+        pag_interes_periodo REAL NOT NULL,
+        pag_multa_periodo REAL NOT NULL,
+        total_aportes REAL NOT NULL,
+        total_retiros REAL NOT NULL,
+        total_prestamos REAL NOT NULL,
+        total_pag_principal REAL NOT NULL,
+        total_pag_interes REAL NOT NULL,
+        total_pag_multa REAL NOT NULL,
+        PRIMARY KEY (periodo, socio_id),
+        FOREIGN KEY (socio_id) REFERENCES socios_web(id)
+    ) WITHOUT ROWID
+    """)
+
+    # Índice cubriente para agregar pagos por préstamo (reporte de morosidad);
+    # reemplaza al anterior, que no cubría monto_principal
+    cur.execute("DROP INDEX IF EXISTS idx_pagos_prestamo_prestamo")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_pagos_prestamo_corte
+    ON pagos_prestamo(prestamo_id, fecha, monto_principal, monto_multa)
+    """)
+
+    # Índices para historiales por socio (paginación por fecha, id)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_aportes_socio_fecha ON aportes(socio_id, fecha)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_retiros_socio_fecha ON retiros(socio_id, fecha)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_prestamos_socio_fecha ON prestamos(socio_id, fecha_inicio)")
+
+    # Índices cubrientes por fecha: los totales de todos los socios sólo
+    # leen los movimientos posteriores al último cierre (ver CIERRES)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_aportes_fecha ON aportes(fecha, socio_id, monto)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_retiros_fecha ON retiros(fecha, socio_id, monto)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_prestamos_fecha ON prestamos(fecha_inicio, socio_id, monto)")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_pagos_prestamo_fecha
+    ON pagos_prestamo(fecha, prestamo_id, monto_principal, monto_interes, monto_multa)
+    """)
+
+    # Contadores de cambios para ETags (ver CACHÉ HTTP)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS versiones_datos (
+        ambito TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    cur.execute(
+        "INSERT OR IGNORE INTO versiones_datos (ambito, version) VALUES ('epoca', ?)",
+        (random.getrandbits(31),)
+    )
+    crear_triggers_version(cur)
+
     # Crear admin por defecto si no existe
     cur.execute("SELECT COUNT(*) FROM admin")
     count_admin = cur.fetchone()[0]
@@ -134,6 +600,583 @@ def inicializar_db():
     conn.close()
 
 
+# ==============================
+# CONTRASEÑAS (scrypt)
+# ==============================
+
+# Formato versionado: "scrypt$1$<n>$<r>$<p>$<salt hex>$<hash hex>".
+# Los hashes antiguos (SHA-256 sin sal, 64 caracteres hex) se siguen
+# aceptando y se actualizan al nuevo formato en el siguiente login correcto.
+HASH_ESQUEMA = "scrypt"
+HASH_VERSION = "1"
+SCRYPT_N = int(os.environ.get("COOP_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.environ.get("COOP_SCRYPT_R", 8))
+SCRYPT_P = int(os.environ.get("COOP_SCRYPT_P", 1))
+SCRYPT_SAL_BYTES = 16
+SCRYPT_DKLEN = 32
+
+# Sal para el cálculo ficticio con cuentas inexistentes (o hashes heredados):
+# así todas las respuestas cuestan un scrypt y no delatan qué cuentas existen.
+_SAL_FICTICIA = os.urandom(SCRYPT_SAL_BYTES)
+
+# Pool acotado para el trabajo del KDF: limita la CPU y la memoria
+# (128 * n * r bytes por cálculo) y evita que una ráfaga de logins
+# deje sin hilos a las demás peticiones.
+HASH_WORKERS = int(os.environ.get("COOP_HASH_WORKERS", 2))
+HASH_COLA_MAX = int(os.environ.get("COOP_HASH_COLA_MAX", 16))
+HASH_TIMEOUT = float(os.environ.get("COOP_HASH_TIMEOUT", 5))
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash")
+_hash_cupos = threading.BoundedSemaphore(HASH_COLA_MAX)
+
+
+class HashOcupado(Exception):
+    """El pool de hashing está saturado; el login debe reintentarse."""
+
+
+def _scrypt(password: str, sal: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=sal, n=n, r=r, p=p,
+        maxmem=128 * r * (n + p + 2) + 1024 * 1024,
+        dklen=SCRYPT_DKLEN
+    )
+
+
+def hash_password(password: str, n=None, r=None, p=None) -> str:
+    n = n or SCRYPT_N
+    r = r or SCRYPT_R
+    p = p or SCRYPT_P
+    sal = os.urandom(SCRYPT_SAL_BYTES)
+    digest = _scrypt(password, sal, n, r, p)
+    return "$".join([HASH_ESQUEMA, HASH_VERSION, str(n), str(r), str(p), sal.hex(), digest.hex()])
+
+
+def verificar_password(password: str, almacenado: str):
+    """Devuelve (correcto, necesita_rehash)."""
+    if not password:
+        return False, False
+    if not almacenado:
+        _scrypt(password, _SAL_FICTICIA, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return False, False
+
+    partes = almacenado.split("$")
+    if len(partes) == 7 and partes[0] == HASH_ESQUEMA and partes[1] == HASH_VERSION:
+        try:
+            n, r, p = int(partes[2]), int(partes[3]), int(partes[4])
+            sal = bytes.fromhex(partes[5])
+            esperado = bytes.fromhex(partes[6])
+        except ValueError:
+            return False, False
+        calculado = _scrypt(password, sal, n, r, p)
+        if not hmac.compare_digest(calculado, esperado):
+            return False, False
+        return True, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+    # Hash heredado: SHA-256 sin sal
+    _scrypt(password, _SAL_FICTICIA, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    legado = hashlib.sha256(password.encode()).hexdigest()
+    if hmac.compare_digest(legado, almacenado):
+        return True, True
+    return False, False
+
+
+def _en_pool_hash(fn, *args):
+    if not _hash_cupos.acquire(blocking=False):
+        raise HashOcupado()
+    try:
+        futuro = _hash_pool.submit(fn, *args)
+    except BaseException:
+        _hash_cupos.release()
+        raise
+    # El cupo se devuelve cuando el cálculo termina (o se cancela), no cuando
+    # el llamador deja de esperar: si no, la cola dejaría de estar acotada.
+    futuro.add_done_callback(lambda _: _hash_cupos.release())
+    try:
+        return futuro.result(timeout=HASH_TIMEOUT)
+    except FuturoVencido:
+        futuro.cancel()  # si todavía no arrancó, no llega a ocupar un hilo
+        raise HashOcupado()
+
+
+def verificar_password_pool(password: str, almacenado: str):
+    return _en_pool_hash(verificar_password, password, almacenado)
+
+
+def hash_password_pool(password: str) -> str:
+    return _en_pool_hash(hash_password, password)
+
+
+def actualizar_hash(tabla: str, fila_id: int, password: str):
+    """Reemplaza un hash heredado o con parámetros viejos tras un login correcto."""
+    try:
+        nuevo = hash_password_pool(password)
+    except HashOcupado:
+        return  # se reintentará en el próximo login
+    conn = db()
+    conn.execute(f"UPDATE {tabla} SET password_hash = ? WHERE id = ?", (nuevo, fila_id))
+    conn.commit()
+    conn.close()
+
+
+def calibrar_scrypt(objetivo_ms: float = 100.0, r: int = 8, p: int = 1, n_max: int = 2 ** 20):
+    """Busca el n (potencia de 2) más alto cuyo tiempo no supera objetivo_ms."""
+    n = 2 ** 10
+    elegido = (n, 0.0)
+    while n <= n_max:
+        inicio = time.perf_counter()
+        _scrypt("calibracion", b"\0" * SCRYPT_SAL_BYTES, n, r, p)
+        ms = (time.perf_counter() - inicio) * 1000
+        if ms > objetivo_ms:
+            break
+        elegido = (n, ms)
+        n *= 2
+    return {"n": elegido[0], "r": r, "p": p, "ms": elegido[1]}
+
+
+# ==============================
+# LIMITACIÓN DE INTENTOS DE LOGIN
+# ==============================
+
+# Token bucket por IP (cada intento) y por cuenta (numero_socio / usuario
+# admin; sólo los fallos), más bloqueo con backoff exponencial tras fallos
+# seguidos de una misma IP contra una cuenta. Así, fallar desde otra IP no
+# bloquea al dueño de la cuenta (hay un único "admin") y sus logins
+# correctos no gastan el cupo de la cuenta. El estado vive en un SQLite
+# aparte (WAL) para compartirlo entre workers de gunicorn sin competir por
+# el lock de escritura de la base principal.
+#   tipo -> (capacidad, tokens por segundo)
+LIMITES_BUCKET = {
+    "ip": (20, 0.2),
+    "cuenta": (50, 50 / 3600),  # tope global de fallos contra la cuenta (ataque distribuido)
+    "cuenta_ip": (5, 1 / 60),
+}
+LIMITES_POR_INTENTO = {"ip"}  # los demás tipos sólo descuentan al fallar
+BLOQUEO_UMBRAL = 5
+BLOQUEO_BASE = 30
+BLOQUEO_MAX = 3600
+LIMITES_PURGA_CADA = 60
+
+_limites_ultima_purga = [0.0]
+
+
+def _abrir_db_auxiliar(ruta: str, esquema: str):
+    """Conexión a un SQLite auxiliar (WAL, sin fsync) con su esquema creado."""
+    conn = sqlite3.connect(ruta, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(esquema)
+    return conn
+
+
+ESQUEMA_LIMITES = """
+CREATE TABLE IF NOT EXISTS limites (
+    clave TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    fallos INTEGER NOT NULL DEFAULT 0,
+    bloqueado_hasta REAL NOT NULL DEFAULT 0,
+    expira REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_limites_expira ON limites(expira);
+"""
+
+_aux_local = threading.local()
+
+
+def _conn_auxiliar(ruta: str, esquema: str):
+    """Una conexión por hilo y por archivo auxiliar (uno por tenant)."""
+    conns = getattr(_aux_local, "conns", None)
+    if conns is None:
+        conns = _aux_local.conns = {}
+    conn = conns.get(ruta)
+    if conn is None:
+        conn = conns[ruta] = _abrir_db_auxiliar(ruta, esquema)
+    return conn
+
+
+def _conn_limites():
+    return _conn_auxiliar(rutas_tenant()["limites"], ESQUEMA_LIMITES)
+
+
+def _claves_login(tipo_cuenta: str, identificador: str):
+    # remote_addr ya viene corregido por ProxyFix si COOP_PROXIES_CONFIABLES > 0
+    ip = request.remote_addr or "-"
+    cuenta = f"{tipo_cuenta}:{(identificador or '').strip().lower()}"
+    return [
+        ("ip", "ip:" + ip),
+        ("cuenta", cuenta),
+        ("cuenta_ip", f"{cuenta}@{ip}"),
+    ]
+
+
+def _expiracion(tipo: str, ahora: float, bloqueado_hasta: float) -> float:
+    capacidad, recarga = LIMITES_BUCKET[tipo]
+    return max(ahora + capacidad / recarga, bloqueado_hasta)
+
+
+def consumir_intento(claves):
+    """Verifica todas las claves y descuenta un token de las que cuentan cada
+    intento. Devuelve segundos de espera (0 = permitido)."""
+    ahora = time.time()
+    conn = _conn_limites()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        espera = 0.0
+        nuevos = []
+        for tipo, clave in claves:
+            capacidad, recarga = LIMITES_BUCKET[tipo]
+            row = conn.execute(
+                "SELECT tokens, actualizado, fallos, bloqueado_hasta FROM limites WHERE clave = ?",
+                (clave,)
+            ).fetchone()
+            if row:
+                tokens = min(capacidad, row[0] + (ahora - row[1]) * recarga)
+                fallos, bloqueado_hasta = row[2], row[3]
+            else:
+                tokens, fallos, bloqueado_hasta = capacidad, 0, 0.0
+
+            if bloqueado_hasta > ahora:
+                espera = max(espera, bloqueado_hasta - ahora)
+            elif tokens < 1:
+                espera = max(espera, (1 - tokens) / recarga)
+            nuevos.append((tipo, clave, tokens, fallos, bloqueado_hasta))
+
+        if espera == 0:
+            for tipo, clave, tokens, fallos, bloqueado_hasta in nuevos:
+                if tipo not in LIMITES_POR_INTENTO:
+                    continue
+                conn.execute("""
+                    INSERT OR REPLACE INTO limites
+                    (clave, tokens, actualizado, fallos, bloqueado_hasta, expira)
+                    VALUES (?,?,?,?,?,?)
+                """, (clave, tokens - 1, ahora, fallos, bloqueado_hasta,
+                      _expiracion(tipo, ahora, bloqueado_hasta)))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    if ahora - _limites_ultima_purga[0] > LIMITES_PURGA_CADA:
+        _limites_ultima_purga[0] = ahora
+        conn.execute("DELETE FROM limites WHERE expira < ?", (ahora,))
+    return espera
+
+
+def registrar_fallo_login(claves):
+    ahora = time.time()
+    conn = _conn_limites()
+    # Una sola transacción: los fallos concurrentes de varios workers no se pisan
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for tipo, clave in claves:
+            if tipo in LIMITES_POR_INTENTO:
+                continue
+            capacidad, recarga = LIMITES_BUCKET[tipo]
+            fallos = conn.execute("""
+                INSERT INTO limites (clave, tokens, actualizado, fallos, bloqueado_hasta, expira)
+                VALUES (:clave, :capacidad - 1, :ahora, 1, 0, :expira)
+                ON CONFLICT(clave) DO UPDATE SET
+                    tokens = MAX(MIN(:capacidad, tokens + (:ahora - actualizado) * :recarga) - 1, 0),
+                    actualizado = :ahora,
+                    fallos = fallos + 1,
+                    expira = MAX(expira, :expira)
+                RETURNING fallos
+            """, {"clave": clave, "capacidad": capacidad, "recarga": recarga, "ahora": ahora,
+                  "expira": _expiracion(tipo, ahora, 0)}).fetchone()[0]
+
+            if tipo == "cuenta_ip" and fallos >= BLOQUEO_UMBRAL:
+                bloqueo = min(BLOQUEO_MAX, BLOQUEO_BASE * 2 ** (fallos - BLOQUEO_UMBRAL))
+                bloqueado_hasta = ahora + bloqueo
+                conn.execute("""
+                    UPDATE limites SET bloqueado_hasta = ?, expira = MAX(expira, ?)
+                    WHERE clave = ?
+                """, (bloqueado_hasta, _expiracion(tipo, ahora, bloqueado_hasta), clave))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def registrar_exito_login(claves):
+    conn = _conn_limites()
+    for tipo, clave in claves:
+        if tipo == "cuenta_ip":
+            conn.execute("UPDATE limites SET fallos = 0, bloqueado_hasta = 0 WHERE clave = ?", (clave,))
+
+
+def respuesta_limitada(plantilla: str, espera: float):
+    segundos = int(espera) + 1
+    msg = f"Demasiados intentos. Intente de nuevo en {segundos} segundos."
+    resp = app.make_response((render_template(plantilla, error=msg), 429))
+    resp.headers["Retry-After"] = str(int(espera) + 1)
+    return resp
+
+
+# ==============================
+# SESIONES EN SERVIDOR
+# ==============================
+
+SESION_COOKIE = "coop_sid"
+SESION_CACHE_MAX = 10000
+SESION_CACHE_TTL = 5  # segundos que otro worker puede tardar en ver una revocación
+SESION_PURGA_CADA = 300
+
+ESQUEMA_SESIONES = """
+CREATE TABLE IF NOT EXISTS sesiones (
+    sid TEXT PRIMARY KEY,
+    datos TEXT NOT NULL,
+    socio_id INTEGER,
+    admin_id INTEGER,
+    expira REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sesiones_expira ON sesiones(expira);
+CREATE INDEX IF NOT EXISTS idx_sesiones_socio ON sesiones(socio_id);
+CREATE INDEX IF NOT EXISTS idx_sesiones_admin ON sesiones(admin_id);
+
+CREATE TABLE IF NOT EXISTS revocaciones (
+    tipo TEXT NOT NULL,
+    usuario_id INTEGER NOT NULL,
+    desde REAL NOT NULL,
+    PRIMARY KEY (tipo, usuario_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS api_tokens (
+    token_hash TEXT PRIMARY KEY,
+    socio_id INTEGER NOT NULL,
+    creado REAL NOT NULL,
+    expira REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_api_tokens_socio ON api_tokens(socio_id);
+CREATE INDEX IF NOT EXISTS idx_api_tokens_expira ON api_tokens(expira);
+"""
+
+_sesiones_rutas = set()
+
+
+def _conn_sesiones(ruta=None):
+    ruta = ruta or rutas_tenant()["sesiones"]
+    _sesiones_rutas.add(ruta)
+    return _conn_auxiliar(ruta, ESQUEMA_SESIONES)
+
+
+class CacheLRU:
+    """LRU en memoria con TTL, protegido por lock (un ejemplar por worker)."""
+
+    def __init__(self, maximo: int, ttl: float):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            valor, vence = item
+            if vence < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + self.ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+
+    def borrar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def borrar_si(self, condicion):
+        """condicion(clave, valor) -> bool"""
+        with self._lock:
+            for clave in [k for k, (v, _) in self._datos.items() if condicion(k, v)]:
+                del self._datos[clave]
+
+
+_cache_sesiones = CacheLRU(SESION_CACHE_MAX, SESION_CACHE_TTL)
+_cache_revocaciones = CacheLRU(SESION_CACHE_MAX, SESION_CACHE_TTL)
+_cache_api_tokens = CacheLRU(SESION_CACHE_MAX, SESION_CACHE_TTL)
+
+
+def _revocado_desde(tipo: str, usuario_id) -> float:
+    clave = (tenant_actual(), tipo, usuario_id)
+    desde = _cache_revocaciones.get(clave)
+    if desde is None:
+        row = _conn_sesiones().execute(
+            "SELECT desde FROM revocaciones WHERE tipo = ? AND usuario_id = ?", (tipo, usuario_id)
+        ).fetchone()
+        desde = row[0] if row else 0.0
+        _cache_revocaciones.set(clave, desde)
+    return desde
+
+
+def revocar_sesiones(tipo: str, usuario_id: int):
+    """Invalida todas las sesiones de un socio ("socio") o admin ("admin")."""
+    columna = "socio_id" if tipo == "socio" else "admin_id"
+    ahora = time.time()
+    conn = _conn_sesiones()
+    conn.execute(f"DELETE FROM sesiones WHERE {columna} = ?", (usuario_id,))
+    conn.execute(
+        "INSERT OR REPLACE INTO revocaciones (tipo, usuario_id, desde) VALUES (?,?,?)",
+        (tipo, usuario_id, ahora)
+    )
+    tenant = tenant_actual()
+    if tipo == "socio":
+        conn.execute("DELETE FROM api_tokens WHERE socio_id = ?", (usuario_id,))
+        _cache_api_tokens.borrar_si(lambda k, t: k[0] == tenant and t[0] == usuario_id)
+    campo = "user_id" if tipo == "socio" else "admin_id"
+    _cache_sesiones.borrar_si(lambda k, d: k[0] == tenant and d.get(campo) == usuario_id)
+    _cache_revocaciones.set((tenant, tipo, usuario_id), ahora)
+
+
+def purgar_sesiones(ruta=None):
+    ahora = time.time()
+    conn = _conn_sesiones(ruta)
+    conn.execute("DELETE FROM sesiones WHERE expira < ?", (ahora,))
+    conn.execute("DELETE FROM api_tokens WHERE expira < ?", (ahora,))
+    conn.execute("DELETE FROM revocaciones WHERE desde < ?", (ahora - SESION_DURACION,))
+
+
+_purga_pid = [None]
+
+
+def _iniciar_purga_sesiones():
+    # Un hilo por proceso; se arranca en la primera petición para que
+    # funcione también con gunicorn --preload (los hilos no sobreviven al fork).
+    if _purga_pid[0] == os.getpid():
+        return
+    _purga_pid[0] = os.getpid()
+
+    def bucle():
+        while True:
+            time.sleep(SESION_PURGA_CADA)
+            for ruta in list(_sesiones_rutas):
+                try:
+                    purgar_sesiones(ruta)
+                except sqlite3.Error:
+                    pass
+
+    threading.Thread(target=bucle, name="purga-sesiones", daemon=True).start()
+
+
+def _sesion_revocada(datos) -> bool:
+    emitida = datos.get("emitida", 0)
+    if datos.get("user_id") and _revocado_desde("socio", datos["user_id"]) >= emitida:
+        return True
+    if datos.get("admin_id") and _revocado_desde("admin", datos["admin_id"]) >= emitida:
+        return True
+    return False
+
+
+class SesionServidor(CallbackDict, SessionMixin):
+
+    def __init__(self, datos=None, sid=None, nueva=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, datos, on_update)
+        self.sid = sid
+        self.new = nueva
+        self.modified = False
+        self.regenerar = False
+
+    def clear(self):
+        # session.clear() en login/logout: el id viejo no se reutiliza
+        super().clear()
+        self.regenerar = True
+
+
+class _CookiePorTenant:
+    # Modo "ruta": cada tenant tiene su propia cookie (/t/<tenant>).
+    def get_cookie_path(self, app):
+        return request.script_root or super().get_cookie_path(app)
+
+
+class InterfazSesionSQLite(_CookiePorTenant, SessionInterface):
+    serializer = session_json_serializer
+
+    def open_session(self, app, request):
+        _iniciar_purga_sesiones()
+        sid = request.cookies.get(SESION_COOKIE)
+        if not sid:
+            return SesionServidor(nueva=True)
+
+        clave = (tenant_actual(), sid)
+        datos = _cache_sesiones.get(clave)
+        if datos is None:
+            row = _conn_sesiones().execute(
+                "SELECT datos, expira FROM sesiones WHERE sid = ?", (sid,)
+            ).fetchone()
+            if not row or row[1] < time.time():
+                return SesionServidor(nueva=True)
+            datos = self.serializer.loads(row[0])
+            _cache_sesiones.set(clave, datos)
+        return SesionServidor(dict(datos), sid=sid)
+
+    def save_session(self, app, session, response):
+        dominio = self.get_cookie_domain(app)
+        ruta = self.get_cookie_path(app)
+        conn = _conn_sesiones()
+
+        if session.sid and (session.regenerar or not session):
+            conn.execute("DELETE FROM sesiones WHERE sid = ?", (session.sid,))
+            _cache_sesiones.borrar((tenant_actual(), session.sid))
+            if not session:
+                response.delete_cookie(SESION_COOKIE, domain=dominio, path=ruta)
+                return
+            session.sid = None
+
+        if not session or not (session.modified or session.regenerar):
+            return
+
+        if not session.sid:
+            session.sid = secrets.token_urlsafe(32)
+            session.setdefault("emitida", time.time())
+        expira = time.time() + SESION_DURACION
+        datos = dict(session)
+        conn.execute("""
+            INSERT OR REPLACE INTO sesiones (sid, datos, socio_id, admin_id, expira)
+            VALUES (?,?,?,?,?)
+        """, (session.sid, self.serializer.dumps(datos),
+              datos.get("user_id"), datos.get("admin_id"), expira))
+        _cache_sesiones.set((tenant_actual(), session.sid), datos)
+
+        response.set_cookie(
+            SESION_COOKIE, session.sid,
+            max_age=SESION_DURACION,
+            httponly=True,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=dominio, path=ruta
+        )
+
+
+class InterfazSesionToken(_CookiePorTenant, SecureCookieSessionInterface):
+    """Cookie firmada (sin estado en servidor) con chequeo de revocación."""
+
+    def open_session(self, app, request):
+        sesion = super().open_session(app, request)
+        if sesion and (sesion.get("tenant", "") != tenant_actual() or _sesion_revocada(sesion)):
+            sesion.clear()
+        return sesion
+
+    def save_session(self, app, session, response):
+        if session and session.modified and "emitida" not in session:
+            session["emitida"] = time.time()
+            session["tenant"] = tenant_actual()
+        return super().save_session(app, session, response)
+
+
+if SESION_BACKEND == "token":
+    app.session_interface = InterfazSesionToken()
+else:
+    app.session_interface = InterfazSesionSQLite()
+
+
 # ==============================
 # DECORADORES
 # ==============================
@@ -155,6 +1198,282 @@ def admin_required(f):
     return wrapper
 
 
+# ==============================
+# CACHÉ HTTP (ETag, 304, gzip)
+# ==============================
+
+# Cada tabla de movimientos mantiene, vía triggers, un contador global
+# (ámbito = nombre de tabla) y uno por socio (ámbito = "socio:<id>").
+# Las vistas declaran de qué ámbitos dependen y, si el ETag del cliente
+# coincide, se responde 304 sin ejecutar consultas ni renderizar.
+#   tabla -> expresión del socio afectado ({fila} = NEW / OLD)
+TABLAS_VERSIONADAS = {
+    "socios_web": "{fila}.id",
+    "aportes": "{fila}.socio_id",
+    "retiros": "{fila}.socio_id",
+    "prestamos": "{fila}.socio_id",
+    "pagos_prestamo": "(SELECT socio_id FROM prestamos WHERE id = {fila}.prestamo_id)",
+}
+
+CACHE_CONTROL_PRIVADO = "private, no-cache"
+GZIP_MINIMO = 1024
+GZIP_NIVEL = 6
+GZIP_TIPOS = ("text/html", "text/css", "text/plain", "application/json", "application/javascript")
+
+# Cambia en cada despliegue para no servir 304 con plantillas viejas. Sin
+# COOP_VERSION_APP es una huella del código, las plantillas y el manifiesto
+# de assets (se calcula al cargar los assets, más abajo); por contenido y no
+# por mtime, así coincide entre servidores con el mismo despliegue.
+VERSION_APP = os.environ.get("COOP_VERSION_APP", "")
+
+
+def crear_triggers_version(cur):
+    # El ámbito del socio puede ser NULL (p. ej. un pago de un préstamo que
+    # no existe): en ese caso sólo se versiona la tabla.
+    upsert = """
+        INSERT INTO versiones_datos (ambito, version)
+        SELECT {ambito}, 1 WHERE {ambito} IS NOT NULL
+        ON CONFLICT(ambito) DO UPDATE SET version = version + 1;"""
+    for tabla, socio_expr in TABLAS_VERSIONADAS.items():
+        for op, filas in (("INSERT", ["NEW"]), ("UPDATE", ["OLD", "NEW"]), ("DELETE", ["OLD"])):
+            cuerpo = upsert.format(ambito=f"'{tabla}'")
+            for fila in filas:
+                cuerpo += upsert.format(ambito="'socio:' || " + socio_expr.format(fila=fila))
+            # trg_version_* eran la primera versión, sin el chequeo de NULL
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_version_{tabla}_{op.lower()}")
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_versiones_{tabla}_{op.lower()}
+            AFTER {op} ON {tabla}
+            BEGIN {cuerpo}
+            END
+            """)
+
+
+def version_datos(ambitos) -> str:
+    ambitos = ["epoca"] + list(ambitos)
+    conn = db()
+    filas = dict(conn.execute(
+        "SELECT ambito, version FROM versiones_datos WHERE ambito IN ({})".format(
+            ",".join("?" * len(ambitos))
+        ),
+        ambitos
+    ).fetchall())
+    conn.close()
+    return "-".join(str(filas.get(a, 0)) for a in ambitos)
+
+
+def nueva_epoca_datos():
+    """Invalida todos los ETags (p. ej. tras restaurar un backup)."""
+    conn = db()
+    conn.execute(
+        "UPDATE versiones_datos SET version = ? WHERE ambito = 'epoca'",
+        (random.getrandbits(31),)
+    )
+    conn.commit()
+    conn.close()
+
+
+def ambitos_socio():
+    return ["socio:%d" % session["user_id"]]
+
+
+def cache_condicional(ambitos):
+    """ambitos: lista fija de ámbitos o función que la devuelve por petición."""
+    def decorador(f):
+        def wrapper(*args, **kwargs):
+            lista = ambitos() if callable(ambitos) else ambitos
+            if kwargs.get("socio_id") is not None:
+                lista = list(lista) + ["socio:%d" % kwargs["socio_id"]]
+            clave = "|".join([VERSION_APP, tenant_actual(), request.path, str(session.get("user_id")),
+                              str(session.get("admin_id")), version_datos(lista)])
+            etag = hashlib.sha1(clave.encode()).hexdigest()[:20]
+
+            if request.if_none_match.contains_weak(etag):
+                resp = app.make_response(("", 304))
+            else:
+                resp = app.make_response(f(*args, **kwargs))
+            if resp.status_code in (200, 304):
+                resp.set_etag(etag, weak=True)
+                resp.headers["Cache-Control"] = CACHE_CONTROL_PRIVADO
+                resp.vary.add("Cookie")
+            return resp
+        wrapper.__name__ = f.__name__
+        return wrapper
+    return decorador
+
+
+@app.after_request
+def comprimir_respuesta(resp):
+    resp.vary.add("Accept-Encoding")
+    if (
+        resp.direct_passthrough
+        or resp.status_code != 200
+        or "Content-Encoding" in resp.headers
+        or resp.mimetype not in GZIP_TIPOS
+        or "gzip" not in request.accept_encodings
+    ):
+        return resp
+
+    datos = resp.get_data()
+    if len(datos) < GZIP_MINIMO:
+        return resp
+    resp.set_data(gzip.compress(datos, compresslevel=GZIP_NIVEL))
+    resp.headers["Content-Encoding"] = "gzip"
+    etag, _ = resp.get_etag()
+    if etag:
+        resp.set_etag(etag, weak=True)
+    return resp
+
+
+@app.after_request
+def cabeceras_privadas(resp):
+    # Datos financieros: nunca en cachés compartidas.
+    resp.headers.setdefault("Cache-Control", "private, no-store")
+    return resp
+
+
+# ==============================
+# ASSETS ESTÁTICOS
+# ==============================
+
+# Bootstrap y bootstrap-icons van en static/vendor (sin CDN: hay sucursales
+# sin internet). Al arrancar se minifican, se les agrega un hash de contenido
+# al nombre y se guarda junto a cada uno una variante .gz; /assets/ los sirve
+# con caché de un año, así que las visitas repetidas sólo bajan el HTML.
+ASSETS_FUENTES = [
+    # primero las fuentes: los CSS que las referencian se reescriben después
+    "vendor/bootstrap-icons/fonts/bootstrap-icons.woff2",
+    "vendor/bootstrap-icons/fonts/bootstrap-icons.woff",
+    "vendor/bootstrap/bootstrap.min.css",
+    "vendor/bootstrap-icons/bootstrap-icons.min.css",
+    "css/app.css",
+]
+ASSETS_MANIFIESTO = os.path.join(ASSETS_DIR, "manifest.json")
+ASSETS_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ASSETS_GZIP_TIPOS = (".css", ".js", ".svg")
+
+_assets_manifiesto = {}
+
+
+def minificar_css(css: str) -> str:
+    # conserva los comentarios /*! ... */ (licencias)
+    css = re.sub(r"/\*(?!!).*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def _reescribir_urls_css(css: str, ruta_css: str, manifiesto: dict) -> str:
+    base = os.path.dirname(ruta_css)
+
+    def reemplazo(m):
+        url = m.group(2)
+        limpia = url.split("?")[0].split("#")[0]
+        destino = os.path.normpath(os.path.join(base, limpia)).replace(os.sep, "/")
+        if destino not in manifiesto:
+            return m.group(0)
+        relativa = os.path.relpath(manifiesto[destino], base or ".").replace(os.sep, "/")
+        return f'url("{relativa}")'
+
+    return re.sub(r"url\((['\"]?)([^'\")]+)\1\)", reemplazo, css)
+
+
+def _escribir_atomico(ruta: str, datos: bytes):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as fh:
+        fh.write(datos)
+    os.replace(temporal, ruta)
+
+
+def construir_assets() -> dict:
+    manifiesto = {}
+    for ruta in ASSETS_FUENTES:
+        with open(os.path.join(STATIC_DIR, ruta), "rb") as fh:
+            datos = fh.read()
+        if ruta.endswith(".css"):
+            css = minificar_css(datos.decode("utf-8"))
+            datos = _reescribir_urls_css(css, ruta, manifiesto).encode("utf-8")
+
+        huella = hashlib.sha256(datos).hexdigest()[:12]
+        raiz, ext = os.path.splitext(ruta)
+        destino = f"{raiz}.{huella}{ext}"
+        salida = os.path.join(ASSETS_DIR, destino)
+        if not os.path.exists(salida):
+            _escribir_atomico(salida, datos)
+            if ext in ASSETS_GZIP_TIPOS:
+                _escribir_atomico(salida + ".gz", gzip.compress(datos, compresslevel=9, mtime=0))
+        manifiesto[ruta] = destino
+
+    _escribir_atomico(ASSETS_MANIFIESTO, json.dumps(manifiesto, indent=2).encode("utf-8"))
+    return manifiesto
+
+
+def cargar_assets():
+    global _assets_manifiesto
+    try:
+        generado = os.path.getmtime(ASSETS_MANIFIESTO)
+        fuentes = max(os.path.getmtime(os.path.join(STATIC_DIR, r)) for r in ASSETS_FUENTES)
+        if generado >= fuentes:
+            with open(ASSETS_MANIFIESTO, encoding="utf-8") as fh:
+                _assets_manifiesto = json.load(fh)
+            return
+    except (OSError, ValueError):
+        pass
+    try:
+        _assets_manifiesto = construir_assets()
+    except OSError:
+        _assets_manifiesto = {}  # p. ej. disco de sólo lectura: se sirve /static sin huella
+
+
+@app.context_processor
+def inyectar_asset_url():
+    def asset_url(ruta: str) -> str:
+        destino = _assets_manifiesto.get(ruta)
+        if destino:
+            return request.script_root + "/assets/" + destino
+        return url_for("static", filename=ruta)
+    return {"asset_url": asset_url}
+
+
+@app.route("/assets/<path:nombre>")
+def servir_asset(nombre):
+    if nombre.endswith(".gz") or nombre == "manifest.json":
+        abort(404)
+    comprimido = os.path.join(ASSETS_DIR, nombre + ".gz")
+    if "gzip" in request.accept_encodings and os.path.isfile(comprimido):
+        resp = send_from_directory(ASSETS_DIR, nombre + ".gz")
+        resp.headers["Content-Encoding"] = "gzip"
+        resp.mimetype = mimetypes.guess_type(nombre)[0] or "application/octet-stream"
+    else:
+        resp = send_from_directory(ASSETS_DIR, nombre)
+    resp.headers["Cache-Control"] = ASSETS_CACHE_CONTROL
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+def huella_despliegue() -> str:
+    h = hashlib.sha256()
+    with open(__file__, "rb") as fh:
+        h.update(fh.read())
+    plantillas = os.path.join(app.root_path, app.template_folder)
+    for raiz, dirs, archivos in os.walk(plantillas):
+        dirs.sort()
+        for nombre in sorted(archivos):
+            ruta = os.path.join(raiz, nombre)
+            h.update(os.path.relpath(ruta, plantillas).encode())
+            with open(ruta, "rb") as fh:
+                h.update(fh.read())
+    h.update(json.dumps(_assets_manifiesto, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+cargar_assets()
+if not VERSION_APP:
+    VERSION_APP = huella_despliegue()
+
+
 # ==============================
 # RUTAS BÁSICAS
 # ==============================
@@ -178,19 +1497,33 @@ def login():
         numero = request.form.get("numero")
         password = request.form.get("password")
 
+        claves = _claves_login("socio", numero)
+        espera = consumir_intento(claves)
+        if espera:
+            return respuesta_limitada("login.html", espera)
+
         conn = db()
         cur = conn.cursor()
         cur.execute("SELECT id, numero_socio, nombre, password_hash FROM socios_web WHERE numero_socio = ?", (numero,))
         row = cur.fetchone()
         conn.close()
 
-        if row and row["password_hash"] == hash_password(password):
+        try:
+            correcto, rehash = verificar_password_pool(password, row["password_hash"] if row else None)
+        except HashOcupado:
+            return render_template("login.html", error="Servicio ocupado, intente de nuevo en unos segundos.")
+
+        if correcto:
+            registrar_exito_login(claves)
+            if rehash:
+                actualizar_hash("socios_web", row["id"], password)
             session.clear()
             session["user_id"] = row["id"]
             session["numero_socio"] = row["numero_socio"]
             session["nombre"] = row["nombre"]
             return redirect("/dashboard")
         else:
+            registrar_fallo_login(claves)
             return render_template("login.html", error="Credenciales incorrectas")
 
     return render_template("login.html")
@@ -206,18 +1539,32 @@ def login_admin():
         usuario = request.form.get("usuario")
         password = request.form.get("password")
 
+        claves = _claves_login("admin", usuario)
+        espera = consumir_intento(claves)
+        if espera:
+            return respuesta_limitada("admin_login.html", espera)
+
         conn = db()
         cur = conn.cursor()
         cur.execute("SELECT id, usuario, password_hash, nombre FROM admin WHERE usuario = ?", (usuario,))
         row = cur.fetchone()
         conn.close()
 
-        if row and row["password_hash"] == hash_password(password):
+        try:
+            correcto, rehash = verificar_password_pool(password, row["password_hash"] if row else None)
+        except HashOcupado:
+            return render_template("admin_login.html", error="Servicio ocupado, intente de nuevo en unos segundos.")
+
+        if correcto:
+            registrar_exito_login(claves)
+            if rehash:
+                actualizar_hash("admin", row["id"], password)
             session.clear()
             session["admin_id"] = row["id"]
             session["admin_nombre"] = row["nombre"]
             return redirect("/admin/panel")
         else:
+            registrar_fallo_login(claves)
             return render_template("admin_login.html", error="Credenciales incorrectas")
 
     return render_template("admin_login.html")
@@ -238,48 +1585,291 @@ def logout():
 # ==============================
 
 def calcular_resumen_socio(socio_id: int):
+    fila = totales_socios(socio_id)
+    if fila is None:
+        fila = {k: 0 for k in COLUMNAS_TOTALES}
+
+    return {
+        "total_aportes": fila["total_aportes"],
+        "total_retiros": fila["total_retiros"],
+        "total_prestamos": fila["total_prestamos"],
+        "total_pag_principal": fila["total_pag_principal"],
+        "total_pag_interes": fila["total_pag_interes"],
+        "total_pag_multa": fila["total_pag_multa"],
+        "saldo_ahorro": fila["total_aportes"] - fila["total_retiros"]
+    }
+
+
+# ==============================
+# CIERRES DE PERÍODO
+# ==============================
+
+# Un cierre guarda, por socio, los totales acumulados al último día del
+# mes. Los resúmenes parten del último cierre y sólo agregan movimientos
+# con fecha posterior, así su costo depende de la actividad reciente y no
+# del largo del historial. Una vez cerrado, no se aceptan movimientos con
+# fecha dentro del período (el snapshot quedaría desfasado).
+COLUMNAS_TOTALES = [
+    "total_aportes", "total_retiros", "total_prestamos",
+    "total_pag_principal", "total_pag_interes", "total_pag_multa",
+]
+
+
+class PeriodoCerrado(ValueError):
+    """Movimiento con fecha dentro de un período ya cerrado."""
+
+
+def _joins_movimientos(alias: str, filtro, por_fecha: bool = False) -> str:
+    """LEFT JOINs con las sumas por socio de cada tipo de movimiento.
+
+    filtro(col_fecha, col_socio) devuelve las condiciones extra del WHERE;
+    las subconsultas quedan como {alias}a, {alias}r, {alias}pr y {alias}pg.
+    Con por_fecha (todos los socios) se fuerzan los índices cubrientes por
+    fecha: el planificador prefiere los de socio para evitar ordenar el
+    GROUP BY, pero eso recorre la historia completa.
+    """
+    def indice(nombre):
+        return f" INDEXED BY {nombre}" if por_fecha else ""
+
+    return f"""
+        LEFT JOIN (
+            SELECT socio_id, SUM(monto) AS suma FROM aportes{indice("idx_aportes_fecha")}
+            WHERE 1 = 1{filtro("fecha", "socio_id")}
+            GROUP BY socio_id
+        ) {alias}a ON {alias}a.socio_id = s.id
+        LEFT JOIN (
+            SELECT socio_id, SUM(monto) AS suma FROM retiros{indice("idx_retiros_fecha")}
+            WHERE 1 = 1{filtro("fecha", "socio_id")}
+            GROUP BY socio_id
+        ) {alias}r ON {alias}r.socio_id = s.id
+        LEFT JOIN (
+            SELECT socio_id, SUM(monto) AS suma FROM prestamos{indice("idx_prestamos_fecha")}
+            WHERE 1 = 1{filtro("fecha_inicio", "socio_id")}
+            GROUP BY socio_id
+        ) {alias}pr ON {alias}pr.socio_id = s.id
+        LEFT JOIN (
+            SELECT p.socio_id,
+                   SUM(pp.monto_principal) AS principal,
+                   SUM(pp.monto_interes) AS interes,
+                   SUM(pp.monto_multa) AS multa
+            FROM pagos_prestamo pp{indice("idx_pagos_prestamo_fecha")}
+            JOIN prestamos p ON pp.prestamo_id = p.id
+            WHERE 1 = 1{filtro("pp.fecha", "p.socio_id")}
+            GROUP BY p.socio_id
+        ) {alias}pg ON {alias}pg.socio_id = s.id
+    """
+
+
+def _sql_totales(desde: bool, hasta: bool, por_socio: bool, base: str = "cierre") -> str:
+    """Totales por socio = base + movimientos en (:desde, :hasta].
+
+    La base es el cierre :periodo, o con base="historia" (todavía no hay
+    cierres) la suma de todos los movimientos con fecha <= :desde.
+    """
+    def filtro(minimo, maximo):
+        def f(col_fecha, col_socio):
+            cond = ""
+            if minimo:
+                cond += f" AND {col_fecha} > :desde"
+            if maximo:
+                cond += f" AND {col_fecha} <= {maximo}"
+            if por_socio:
+                cond += f" AND {col_socio} = :socio_id"
+            return cond
+        return f
+
+    joins = _joins_movimientos("", filtro(desde, ":hasta" if hasta else None), not por_socio)
+    if base == "historia":
+        joins += _joins_movimientos("h", filtro(False, ":desde"), not por_socio)
+        previo = {
+            "saldo": "COALESCE(ha.suma, 0) - COALESCE(hr.suma, 0)",
+            "aportes": "COALESCE(ha.suma, 0)",
+            "retiros": "COALESCE(hr.suma, 0)",
+            "prestamos": "COALESCE(hpr.suma, 0)",
+            "pag_principal": "COALESCE(hpg.principal, 0)",
+            "pag_interes": "COALESCE(hpg.interes, 0)",
+            "pag_multa": "COALESCE(hpg.multa, 0)",
+        }
+    else:
+        joins = "LEFT JOIN cierres c ON c.periodo = :periodo AND c.socio_id = s.id" + joins
+        previo = {"saldo": "COALESCE(c.saldo_final, 0)"}
+        for k in ("aportes", "retiros", "prestamos", "pag_principal", "pag_interes", "pag_multa"):
+            previo[k] = f"COALESCE(c.total_{k}, 0)"
+
+    return f"""
+        SELECT s.id AS socio_id, s.numero_socio, s.nombre,
+               {previo["saldo"]} AS saldo_previo,
+               COALESCE(a.suma, 0) AS aportes_periodo,
+               COALESCE(r.suma, 0) AS retiros_periodo,
+               COALESCE(pr.suma, 0) AS prestamos_periodo,
+               COALESCE(pg.principal, 0) AS pag_principal_periodo,
+               COALESCE(pg.interes, 0) AS pag_interes_periodo,
+               COALESCE(pg.multa, 0) AS pag_multa_periodo,
+               {previo["aportes"]} + COALESCE(a.suma, 0) AS total_aportes,
+               {previo["retiros"]} + COALESCE(r.suma, 0) AS total_retiros,
+               {previo["prestamos"]} + COALESCE(pr.suma, 0) AS total_prestamos,
+               {previo["pag_principal"]} + COALESCE(pg.principal, 0) AS total_pag_principal,
+               {previo["pag_interes"]} + COALESCE(pg.interes, 0) AS total_pag_interes,
+               {previo["pag_multa"]} + COALESCE(pg.multa, 0) AS total_pag_multa
+        FROM socios_web s
+        {joins}
+        {"WHERE s.id = :socio_id" if por_socio else ""}
+    """
+
+
+def ultimo_cierre(cur):
+    cur.execute("SELECT periodo, fecha_corte FROM periodos_cerrados ORDER BY periodo DESC LIMIT 1")
+    return cur.fetchone()
+
+
+def totales_socios(socio_id=None):
+    """Totales actuales (último cierre + movimientos posteriores).
+
+    Con socio_id devuelve una fila (o None); sin él, una por socio.
+    """
     conn = db()
     cur = conn.cursor()
+    cierre = ultimo_cierre(cur)
+    sql = _sql_totales(desde=bool(cierre), hasta=False, por_socio=socio_id is not None)
+    params = {
+        "periodo": cierre["periodo"] if cierre else "",
+        "desde": cierre["fecha_corte"] if cierre else "",
+        "socio_id": socio_id,
+    }
+    if socio_id is not None:
+        cur.execute(sql, params)
+        res = cur.fetchone()
+    else:
+        cur.execute(sql + " ORDER BY s.numero_socio", params)
+        res = cur.fetchall()
+    conn.close()
+    return res
 
-    cur.execute("SELECT COALESCE(SUM(monto),0) FROM aportes WHERE socio_id = ?", (socio_id,))
-    total_aportes = cur.fetchone()[0]
 
-    cur.execute("SELECT COALESCE(SUM(monto),0) FROM retiros WHERE socio_id = ?", (socio_id,))
-    total_retiros = cur.fetchone()[0]
+def verificar_periodo_abierto(cur, fecha):
+    cur.execute("SELECT MAX(fecha_corte) FROM periodos_cerrados")
+    corte = cur.fetchone()[0]
+    if corte and fecha and fecha <= corte:
+        raise PeriodoCerrado(f"La fecha {fecha} pertenece a un período cerrado (hasta {corte}).")
 
-    cur.execute("""
-        SELECT COALESCE(SUM(monto),0)
-        FROM prestamos
-        WHERE socio_id = ?
-    """, (socio_id,))
-    total_prestamos = cur.fetchone()[0]
 
-    cur.execute("""
-        SELECT COALESCE(SUM(monto_principal),0),
-               COALESCE(SUM(monto_interes),0),
-               COALESCE(SUM(monto_multa),0)
-        FROM pagos_prestamo pp
-        JOIN prestamos p ON pp.prestamo_id = p.id
-        WHERE p.socio_id = ?
-    """, (socio_id,))
-    fila = cur.fetchone()
-    total_pag_principal = fila[0]
-    total_pag_interes = fila[1]
-    total_pag_multa = fila[2]
+def _fin_de_mes(periodo: str) -> str:
+    anio, mes = (int(x) for x in periodo.split("-"))
+    return f"{periodo}-{calendar.monthrange(anio, mes)[1]:02d}"
 
-    conn.close()
 
-    saldo_ahorro = total_aportes - total_retiros
+def _periodo_siguiente(periodo: str) -> str:
+    anio, mes = (int(x) for x in periodo.split("-"))
+    return f"{anio + mes // 12}-{mes % 12 + 1:02d}"
+
+
+def _periodo_anterior(periodo: str) -> str:
+    anio, mes = (int(x) for x in periodo.split("-"))
+    return f"{anio - (mes == 1)}-{(mes - 2) % 12 + 1:02d}"
 
-    return {
-        "total_aportes": total_aportes,
-        "total_retiros": total_retiros,
-        "total_prestamos": total_prestamos,
-        "total_pag_principal": total_pag_principal,
-        "total_pag_interes": total_pag_interes,
-        "total_pag_multa": total_pag_multa,
-        "saldo_ahorro": saldo_ahorro
-    }
+
+def cerrar_periodo(periodo: str) -> int:
+    """Cierra el mes "AAAA-MM" en una sola pasada; devuelve los socios cerrados."""
+    if not re.match(r"^\d{4}-(0[1-9]|1[0-2])$", periodo or ""):
+        raise ValueError("Período inválido, use AAAA-MM.")
+    fecha_corte = _fin_de_mes(periodo)
+    if fecha_corte >= date.today().isoformat():
+        raise ValueError(f"El período {periodo} todavía no terminó.")
+
+    def cerrar(c):
+        anterior = ultimo_cierre(c)
+        if anterior:
+            esperado = _periodo_siguiente(anterior["periodo"])
+            if periodo != esperado:
+                raise ValueError(f"El próximo período a cerrar es {esperado}.")
+
+        if anterior:
+            sql = _sql_totales(desde=True, hasta=True, por_socio=False)
+            desde = anterior["fecha_corte"]
+        else:
+            # primer cierre: el saldo inicial sale de toda la historia previa al mes
+            sql = _sql_totales(desde=True, hasta=True, por_socio=False, base="historia")
+            desde = _fin_de_mes(_periodo_anterior(periodo))
+
+        c.execute(f"""
+            INSERT INTO cierres (
+                periodo, socio_id, saldo_inicial, saldo_final,
+                aportes_periodo, retiros_periodo, prestamos_periodo,
+                pag_principal_periodo, pag_interes_periodo, pag_multa_periodo,
+                total_aportes, total_retiros, total_prestamos,
+                total_pag_principal, total_pag_interes, total_pag_multa
+            )
+            SELECT :nuevo, socio_id, saldo_previo,
+                   saldo_previo + aportes_periodo - retiros_periodo,
+                   aportes_periodo, retiros_periodo, prestamos_periodo,
+                   pag_principal_periodo, pag_interes_periodo, pag_multa_periodo,
+                   total_aportes, total_retiros, total_prestamos,
+                   total_pag_principal, total_pag_interes, total_pag_multa
+            FROM ({sql})
+        """, {
+            "nuevo": periodo,
+            "periodo": anterior["periodo"] if anterior else "",
+            "desde": desde,
+            "hasta": fecha_corte,
+        })
+        socios = c.rowcount
+
+        # control: el snapshot tiene que cuadrar con la historia completa al corte
+        c.execute("""
+            SELECT (SELECT COALESCE(SUM(monto), 0) FROM aportes
+                    WHERE fecha <= :hasta AND socio_id IN (SELECT id FROM socios_web)),
+                   (SELECT COALESCE(SUM(monto), 0) FROM retiros
+                    WHERE fecha <= :hasta AND socio_id IN (SELECT id FROM socios_web)),
+                   (SELECT COALESCE(SUM(monto), 0) FROM aportes
+                    WHERE fecha > :desde AND fecha <= :hasta AND socio_id IN (SELECT id FROM socios_web)),
+                   COALESCE(SUM(total_aportes), 0), COALESCE(SUM(saldo_final), 0),
+                   COALESCE(SUM(aportes_periodo), 0)
+            FROM cierres WHERE periodo = :nuevo
+        """, {"nuevo": periodo, "desde": desde, "hasta": fecha_corte})
+        aportes, retiros, aportes_mes, snap_aportes, snap_saldo, snap_mes = c.fetchone()
+        if (abs(aportes - snap_aportes) > 0.005 or abs(aportes - retiros - snap_saldo) > 0.005
+                or abs(aportes_mes - snap_mes) > 0.005):
+            raise ValueError(f"El cierre de {periodo} no cuadra con los movimientos; no se guardó.")
+
+        c.execute(
+            "INSERT INTO periodos_cerrados (periodo, fecha_corte, socios, creado) VALUES (?,?,?,?)",
+            (periodo, fecha_corte, socios, datetime.now().strftime("%Y-%m-%d %H:%M"))
+        )
+        # los estados de cuenta cambian (saldo inicial), aunque los totales no
+        c.execute("""
+            INSERT INTO versiones_datos (ambito, version) VALUES ('cierres', 1)
+            ON CONFLICT(ambito) DO UPDATE SET version = version + 1
+        """)
+        return socios
+
+    return escribir(cerrar)
+
+
+@app.route("/admin/cierres", methods=["GET", "POST"])
+@admin_required
+def admin_cierres():
+    error = None
+    ok = None
+    if request.method == "POST":
+        periodo = request.form.get("periodo")
+        try:
+            socios = cerrar_periodo(periodo)
+            ok = f"Período {periodo} cerrado ({socios} socios)."
+        except (ValueError, ErrorEscritura) as e:
+            error = str(e)
+
+    conn = db()
+    cur = conn.cursor()
+    cur.execute("SELECT periodo, fecha_corte, socios, creado FROM periodos_cerrados ORDER BY periodo DESC")
+    periodos = cur.fetchall()
+    conn.close()
+
+    if periodos:
+        sugerido = _periodo_siguiente(periodos[0]["periodo"])
+    else:
+        sugerido = _periodo_anterior(date.today().strftime("%Y-%m"))
+    return render_template("admin_cierres.html", periodos=periodos, sugerido=sugerido,
+                           error=error, success=ok)
 
 
 # ==============================
@@ -288,70 +1878,247 @@ def calcular_resumen_socio(socio_id: int):
 
 @app.route("/dashboard")
 @login_required
+@cache_condicional(ambitos_socio)
 def dashboard():
     socio_id = session["user_id"]
     resumen = calcular_resumen_socio(socio_id)
     return render_template("dashboard.html", nombre=session["nombre"], resumen=resumen)
 
 
+#   tipo -> (consulta base filtrada por socio, columna de fecha, columna id)
+HISTORIALES = {
+    "aportes": ("""
+        SELECT a.id, a.fecha, a.monto, a.frecuencia
+        FROM aportes a
+        WHERE a.socio_id = ?
+    """, "a.fecha", "a.id"),
+    "retiros": ("""
+        SELECT r.id, r.fecha, r.monto, r.motivo
+        FROM retiros r
+        WHERE r.socio_id = ?
+    """, "r.fecha", "r.id"),
+    "prestamos": ("""
+        SELECT p.id, p.fecha_inicio, p.fecha_fin, p.monto, p.tasa_interes,
+               p.tipo_interes, p.saldo_pendiente, p.estado
+        FROM prestamos p
+        WHERE p.socio_id = ?
+    """, "p.fecha_inicio", "p.id"),
+    "pagos": ("""
+        SELECT pp.id, pp.prestamo_id, pp.fecha, pp.monto_principal,
+               pp.monto_interes, pp.monto_multa
+        FROM pagos_prestamo pp
+        JOIN prestamos p ON pp.prestamo_id = p.id
+        WHERE p.socio_id = ?
+    """, "pp.fecha", "pp.id"),
+}
+
+
+def consultar_historial(tipo: str, socio_id: int, limite=None, despues=None):
+    """Movimientos del socio, más recientes primero.
+
+    despues: (fecha, id) de la última fila ya entregada (paginación keyset).
+    """
+    sql, col_fecha, col_id = HISTORIALES[tipo]
+    params = [socio_id]
+    if despues:
+        sql += f" AND ({col_fecha}, {col_id}) < (?, ?)"
+        params += list(despues)
+    sql += f" ORDER BY {col_fecha} DESC, {col_id} DESC"
+    if limite:
+        sql += " LIMIT ?"
+        params.append(limite)
+
+    conn = db()
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    return rows
+
+
 @app.route("/aportes")
 @login_required
+@cache_condicional(ambitos_socio)
 def ver_aportes():
-    socio_id = session["user_id"]
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT fecha, monto, frecuencia FROM aportes WHERE socio_id = ? ORDER BY fecha DESC", (socio_id,))
-    rows = cur.fetchall()
-    conn.close()
+    rows = consultar_historial("aportes", session["user_id"])
     return render_template("aportes.html", rows=rows)
 
 
 @app.route("/retiros")
 @login_required
+@cache_condicional(ambitos_socio)
 def ver_retiros():
-    socio_id = session["user_id"]
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT fecha, monto, motivo FROM retiros WHERE socio_id = ? ORDER BY fecha DESC", (socio_id,))
-    rows = cur.fetchall()
-    conn.close()
+    rows = consultar_historial("retiros", session["user_id"])
     return render_template("retiros.html", rows=rows)
 
 
 @app.route("/prestamos")
 @login_required
+@cache_condicional(ambitos_socio)
 def ver_prestamos():
-    socio_id = session["user_id"]
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT fecha_inicio, fecha_fin, monto, tasa_interes,
-               tipo_interes, saldo_pendiente, estado
-        FROM prestamos
-        WHERE socio_id = ?
-        ORDER BY fecha_inicio DESC
-    """, (socio_id,))
-    rows = cur.fetchall()
-    conn.close()
+    rows = consultar_historial("prestamos", session["user_id"])
     return render_template("prestamos.html", rows=rows)
 
 
 @app.route("/pagos")
 @login_required
+@cache_condicional(ambitos_socio)
 def ver_pagos():
-    socio_id = session["user_id"]
+    rows = consultar_historial("pagos", session["user_id"])
+    return render_template("pagos.html", rows=rows)
+
+
+# ==============================
+# API JSON v1 (socios)
+# ==============================
+
+# Vistas síncronas como el resto de la app: la concurrencia la da el
+# servidor con hilos (gunicorn --worker-class gthread, o asgi.py con su
+# pool), no un event loop dentro de Flask.
+# Las respuestas de listas son compactas: {"campos": [...], "datos": [[...]]}.
+API_TOKEN_DURACION = int(os.environ.get("COOP_API_TOKEN_DURACION", 30 * 24 * 3600))
+API_LIMITE_DEFECTO = 50
+API_LIMITE_MAX = 500
+
+
+def api_error(mensaje: str, status: int):
+    return jsonify({"error": mensaje}), status
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def emitir_api_token(socio_id: int) -> str:
+    token = secrets.token_urlsafe(32)
+    ahora = time.time()
+    _conn_sesiones().execute(
+        "INSERT INTO api_tokens (token_hash, socio_id, creado, expira) VALUES (?,?,?,?)",
+        (_hash_token(token), socio_id, ahora, ahora + API_TOKEN_DURACION)
+    )
+    return token
+
+
+def socio_de_api_token(token: str):
+    token_hash = _hash_token(token)
+    clave = (tenant_actual(), token_hash)
+    item = _cache_api_tokens.get(clave)
+    if item is None:
+        row = _conn_sesiones().execute(
+            "SELECT socio_id, creado, expira FROM api_tokens WHERE token_hash = ?", (token_hash,)
+        ).fetchone()
+        if not row:
+            return None
+        item = tuple(row)
+        _cache_api_tokens.set(clave, item)
+    socio_id, creado, expira = item
+    if expira < time.time() or _revocado_desde("socio", socio_id) >= creado:
+        return None
+    return socio_id
+
+
+def api_token_required(f):
+    def wrapper(*args, **kwargs):
+        cabecera = request.headers.get("Authorization", "")
+        if not cabecera.startswith("Bearer "):
+            return api_error("Falta el token.", 401)
+        socio_id = socio_de_api_token(cabecera[7:].strip())
+        if not socio_id:
+            return api_error("Token inválido o vencido.", 401)
+        g.socio_id = socio_id
+        return f(*args, **kwargs)
+    wrapper.__name__ = f.__name__
+    return wrapper
+
+
+def _cursor_codificar(fecha, fila_id) -> str:
+    return base64.urlsafe_b64encode(f"{fecha}|{fila_id}".encode()).decode().rstrip("=")
+
+
+def _cursor_decodificar(cursor: str):
+    try:
+        texto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        fecha, fila_id = texto.rsplit("|", 1)
+        return fecha, int(fila_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+@app.route("/api/v1/token", methods=["POST"])
+def api_token():
+    datos = request.get_json(silent=True)
+    if datos is None:
+        datos = request.form
+    elif not isinstance(datos, dict):
+        return api_error("Se espera un objeto JSON.", 400)
+    numero = datos.get("numero")
+    password = datos.get("password")
+    if not isinstance(numero or "", str) or not isinstance(password or "", str):
+        return api_error("numero y password deben ser texto.", 400)
+
+    claves = _claves_login("socio", numero)
+    espera = consumir_intento(claves)
+    if espera:
+        resp = jsonify({"error": "Demasiados intentos."})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = str(int(espera) + 1)
+        return resp
+
     conn = db()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT pp.fecha, pp.monto_principal, pp.monto_interes, pp.monto_multa
-        FROM pagos_prestamo pp
-        JOIN prestamos p ON pp.prestamo_id = p.id
-        WHERE p.socio_id = ?
-        ORDER BY pp.fecha DESC
-    """, (socio_id,))
-    rows = cur.fetchall()
+    row = conn.execute(
+        "SELECT id, password_hash FROM socios_web WHERE numero_socio = ?", (numero,)
+    ).fetchone()
     conn.close()
-    return render_template("pagos.html", rows=rows)
+
+    try:
+        correcto, rehash = verificar_password_pool(password, row["password_hash"] if row else None)
+    except HashOcupado:
+        return api_error("Servicio ocupado, intente de nuevo.", 503)
+
+    if not correcto:
+        registrar_fallo_login(claves)
+        return api_error("Credenciales incorrectas.", 401)
+
+    registrar_exito_login(claves)
+    if rehash:
+        actualizar_hash("socios_web", row["id"], password)
+    token = emitir_api_token(row["id"])
+    return jsonify({"token": token, "expira_en": API_TOKEN_DURACION})
+
+
+@app.route("/api/v1/resumen")
+@api_token_required
+def api_resumen():
+    resumen = calcular_resumen_socio(g.socio_id)
+    return jsonify(resumen)
+
+
+@app.route("/api/v1/<any(aportes, retiros, prestamos, pagos):tipo>")
+@api_token_required
+def api_historial(tipo):
+    try:
+        limite = min(API_LIMITE_MAX, max(1, int(request.args.get("limite", API_LIMITE_DEFECTO))))
+    except ValueError:
+        return api_error("limite inválido.", 400)
+
+    despues = None
+    if request.args.get("despues"):
+        despues = _cursor_decodificar(request.args["despues"])
+        if not despues:
+            return api_error("Cursor inválido.", 400)
+
+    # se pide una fila de más para saber si hay otra página
+    rows = consultar_historial(tipo, g.socio_id, limite + 1, despues)
+    siguiente = None
+    if len(rows) > limite:
+        rows = rows[:limite]
+        _, col_fecha, _ = HISTORIALES[tipo]
+        ultima = rows[-1]
+        siguiente = _cursor_codificar(ultima[col_fecha.split(".")[1]], ultima["id"])
+
+    return jsonify({
+        "campos": list(rows[0].keys()) if rows else [],
+        "datos": [list(r) for r in rows],
+        "siguiente": siguiente,
+    })
 
 
 # ==============================
@@ -360,34 +2127,37 @@ def ver_pagos():
 
 @app.route("/admin/panel")
 @admin_required
+@cache_condicional(["socios_web", "aportes", "retiros", "prestamos"])
 def admin_panel():
-    conn = db()
-    cur = conn.cursor()
-
-    cur.execute("SELECT COUNT(*) FROM socios_web")
-    total_socios = cur.fetchone()[0]
+    return render_template("admin_panel.html", **resumen_cooperativa())
 
-    cur.execute("SELECT COALESCE(SUM(monto),0) FROM aportes")
-    total_aportes = cur.fetchone()[0]
 
-    cur.execute("SELECT COALESCE(SUM(monto),0) FROM retiros")
-    total_retiros = cur.fetchone()[0]
+def resumen_cooperativa():
+    conn = db()
+    cur = conn.cursor()
 
-    cur.execute("SELECT COALESCE(SUM(monto),0) FROM prestamos")
-    total_prestamos = cur.fetchone()[0]
+    cierre = ultimo_cierre(cur)
+    cur.execute("""
+        SELECT COUNT(*),
+               COALESCE(SUM(total_aportes),0),
+               COALESCE(SUM(total_retiros),0),
+               COALESCE(SUM(total_prestamos),0)
+        FROM ({})
+    """.format(_sql_totales(desde=bool(cierre), hasta=False, por_socio=False)), {
+        "periodo": cierre["periodo"] if cierre else "",
+        "desde": cierre["fecha_corte"] if cierre else "",
+    })
+    total_socios, total_aportes, total_retiros, total_prestamos = cur.fetchone()
 
     conn.close()
 
-    saldo_neto = total_aportes - total_retiros
-
-    return render_template(
-        "admin_panel.html",
-        total_socios=total_socios,
-        total_aportes=total_aportes,
-        total_retiros=total_retiros,
-        total_prestamos=total_prestamos,
-        saldo_neto=saldo_neto
-    )
+    return {
+        "total_socios": total_socios,
+        "total_aportes": total_aportes,
+        "total_retiros": total_retiros,
+        "total_prestamos": total_prestamos,
+        "saldo_neto": total_aportes - total_retiros
+    }
 
 
 # ==============================
@@ -396,24 +2166,18 @@ def admin_panel():
 
 @app.route("/admin/saldos")
 @admin_required
+@cache_condicional(["socios_web", "aportes", "retiros", "prestamos"])
 def admin_saldos():
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, numero_socio, nombre FROM socios_web ORDER BY numero_socio")
-    socios = cur.fetchall()
-    conn.close()
-
     lista = []
-    for s in socios:
-        resumen = calcular_resumen_socio(s["id"])
+    for s in totales_socios():
         lista.append({
-            "id": s["id"],
+            "id": s["socio_id"],
             "numero_socio": s["numero_socio"],
             "nombre": s["nombre"],
-            "saldo_ahorro": resumen["saldo_ahorro"],
-            "total_aportes": resumen["total_aportes"],
-            "total_retiros": resumen["total_retiros"],
-            "total_prestamos": resumen["total_prestamos"]
+            "saldo_ahorro": s["total_aportes"] - s["total_retiros"],
+            "total_aportes": s["total_aportes"],
+            "total_retiros": s["total_retiros"],
+            "total_prestamos": s["total_prestamos"]
         })
 
     return render_template("admin_saldos.html", saldos=lista)
@@ -421,6 +2185,7 @@ def admin_saldos():
 
 @app.route("/admin/saldos/<int:socio_id>/pdf")
 @admin_required
+@cache_condicional(["socios_web", "cierres"])
 def admin_saldo_pdf(socio_id):
     conn = db()
     cur = conn.cursor()
@@ -432,11 +2197,24 @@ def admin_saldo_pdf(socio_id):
 
     resumen = calcular_resumen_socio(socio_id)
 
+    # El detalle parte del último cierre: saldo inicial + movimientos posteriores
+    cierre = ultimo_cierre(cur)
+    saldo_inicial = 0
+    desde = ""
+    params = (socio_id,)
+    if cierre:
+        cur.execute("SELECT saldo_final FROM cierres WHERE periodo = ? AND socio_id = ?",
+                    (cierre["periodo"], socio_id))
+        fila = cur.fetchone()
+        saldo_inicial = fila["saldo_final"] if fila else 0
+        desde = " AND fecha > ?"
+        params = (socio_id, cierre["fecha_corte"])
+
     # Transacciones para detalle básico
-    cur.execute("SELECT fecha, monto, frecuencia FROM aportes WHERE socio_id = ? ORDER BY fecha", (socio_id,))
+    cur.execute(f"SELECT fecha, monto, frecuencia FROM aportes WHERE socio_id = ?{desde} ORDER BY fecha", params)
     aportes = cur.fetchall()
 
-    cur.execute("SELECT fecha, monto, motivo FROM retiros WHERE socio_id = ? ORDER BY fecha", (socio_id,))
+    cur.execute(f"SELECT fecha, monto, motivo FROM retiros WHERE socio_id = ?{desde} ORDER BY fecha", params)
     retiros = cur.fetchall()
 
     cur.execute("""
@@ -451,16 +2229,16 @@ def admin_saldo_pdf(socio_id):
         SELECT pp.fecha, pp.monto_principal, pp.monto_interes, pp.monto_multa
         FROM pagos_prestamo pp
         JOIN prestamos p ON pp.prestamo_id = p.id
-        WHERE p.socio_id = ?
+        WHERE p.socio_id = ?{}
         ORDER BY pp.fecha
-    """, (socio_id,))
+    """.format(desde.replace("fecha", "pp.fecha")), params)
     pagos = cur.fetchall()
 
     conn.close()
 
     # Generar PDF en memoria
     buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
+    p = canvas.Canvas(buffer, pagesize=letter, pageCompression=1)
     width, height = letter
 
     y = height - 50
@@ -487,6 +2265,14 @@ def admin_saldo_pdf(socio_id):
     p.drawString(60, y, f"Total préstamos:       ${resumen['total_prestamos']:.2f}")
     y -= 25
 
+    if cierre:
+        p.setFont("Helvetica-Bold", 12)
+        p.drawString(50, y, f"Movimientos desde el cierre {cierre['periodo']}")
+        y -= 15
+        p.setFont("Helvetica", 10)
+        p.drawString(60, y, f"Saldo ahorro al {cierre['fecha_corte']}:  ${saldo_inicial:.2f}")
+        y -= 25
+
     # Sección aportes
     p.setFont("Helvetica-Bold", 12)
     p.drawString(50, y, "Aportes")
@@ -550,6 +2336,271 @@ def admin_saldo_pdf(socio_id):
     return send_file(buffer, as_attachment=True, download_name=filename, mimetype="application/pdf")
 
 
+# ==============================
+# ADMIN: MOROSIDAD Y CARTERA EN RIESGO
+# ==============================
+
+# Sin plan de cuotas, el atraso se mide desde fecha_fin: un préstamo con
+# saldo pendiente y fecha_fin anterior al corte está vencido.
+#   (clave, etiqueta, días mínimos)
+TRAMOS_MORA = [
+    ("al_dia", "Al día", 0),
+    ("1_29", "1-29 días", 1),
+    ("30_59", "30-59 días", 30),
+    ("60_89", "60-89 días", 60),
+    ("90_mas", "90+ días", 90),
+]
+PAR_UMBRALES = (30, 60, 90)
+
+MOROSIDAD_POR_PAGINA = 50
+
+# Sólo se cachean los agregados y las páginas ya filtradas (pocos KB cada
+# una), nunca el detalle completo de la cartera.
+_cache_morosidad = CacheLRU(64, 24 * 3600)
+_cache_morosidad_paginas = CacheLRU(256, 24 * 3600)
+
+
+def _sql_morosidad() -> str:
+    """Cartera al corte (:corte), una fila por préstamo; usar como subconsulta.
+
+    Los pagos se agregan por préstamo (índice idx_pagos_prestamo_corte). El
+    saldo es el que tenía el préstamo al corte, no el saldo_pendiente de
+    hoy, para que un corte pasado no pierda préstamos cancelados después.
+    """
+    tramo = " ".join(
+        f"WHEN dias_atraso >= {minimo} THEN '{clave}'" for clave, _, minimo in reversed(TRAMOS_MORA[1:])
+    )
+    return f"""
+        WITH pagos AS (
+            SELECT prestamo_id,
+                   MAX(fecha) AS ultimo_pago,
+                   COALESCE(SUM(monto_principal), 0) AS principal,
+                   COALESCE(SUM(monto_multa), 0) AS multas
+            FROM pagos_prestamo
+            WHERE fecha <= :corte
+            GROUP BY prestamo_id
+        ),
+        cartera AS (
+            SELECT p.*, pg.ultimo_pago, COALESCE(pg.multas, 0) AS multas,
+                   MAX(p.monto - COALESCE(pg.principal, 0), 0) AS saldo_corte
+            FROM prestamos p
+            LEFT JOIN pagos pg ON pg.prestamo_id = p.id
+            WHERE p.fecha_inicio <= :corte
+        ),
+        filas AS (
+            SELECT c.id, s.numero_socio, s.nombre, c.fecha_inicio, c.fecha_fin,
+                   c.monto, c.saldo_corte AS saldo_pendiente, c.estado,
+                   c.ultimo_pago, c.multas,
+                   CASE
+                       WHEN c.saldo_corte > 0
+                            AND COALESCE(c.fecha_fin, '') <> ''
+                            AND c.fecha_fin < :corte
+                       THEN CAST(julianday(:corte) - julianday(c.fecha_fin) AS INTEGER)
+                       ELSE 0
+                   END AS dias_atraso
+            FROM cartera c
+            JOIN socios_web s ON s.id = c.socio_id
+        )
+        SELECT filas.*, CASE {tramo} ELSE '{TRAMOS_MORA[0][0]}' END AS tramo
+        FROM filas
+    """
+
+
+def _calcular_morosidad(corte: str):
+    # Una sola pasada por la cartera: totales por tramo y, en cada tramo,
+    # el saldo que cae en cada umbral de PAR (después se suman).
+    columnas_par = "".join(
+        f""",
+               SUM(CASE WHEN saldo_pendiente > 0 AND dias_atraso >= {u}
+                        THEN saldo_pendiente ELSE 0 END) AS par_{u}"""
+        for u in PAR_UMBRALES
+    )
+    conn = db()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT tramo,
+               SUM(saldo_pendiente > 0) AS cantidad,
+               SUM(CASE WHEN saldo_pendiente > 0 THEN saldo_pendiente ELSE 0 END) AS saldo,
+               SUM(multas) AS multas{columnas_par}
+        FROM ({_sql_morosidad()})
+        GROUP BY tramo
+    """, {"corte": corte})
+    por_tramo = {f["tramo"]: f for f in cur.fetchall()}
+    conn.close()
+
+    en_riesgo = {u: sum(f[f"par_{u}"] for f in por_tramo.values()) for u in PAR_UMBRALES}
+
+    tramos = []
+    for k, e, _ in TRAMOS_MORA:
+        f = por_tramo.get(k)
+        tramos.append({
+            "clave": k, "etiqueta": e,
+            "cantidad": f["cantidad"] if f else 0,
+            "saldo": f["saldo"] if f else 0.0,
+            "multas": f["multas"] if f else 0.0,
+        })
+    cartera = sum(t["saldo"] for t in tramos)
+
+    return {
+        "corte": corte,
+        "tramos": tramos,
+        "cartera": cartera,
+        "par": {u: (en_riesgo[u] / cartera if cartera else 0.0) for u in PAR_UMBRALES},
+        "saldo_en_riesgo": en_riesgo,
+        "multas_total": sum(t["multas"] for t in tramos),
+    }
+
+
+def _version_morosidad():
+    return version_datos(["socios_web", "prestamos", "pagos_prestamo"])
+
+
+def reporte_morosidad(corte: str):
+    """Agregados de la cartera al corte, cacheados por día y versión de datos."""
+    clave = (tenant_actual(), corte, _version_morosidad())
+    reporte = _cache_morosidad.get(clave)
+    if reporte is None:
+        reporte = _calcular_morosidad(corte)
+        _cache_morosidad.set(clave, reporte)
+    return reporte
+
+
+def _filtros_morosidad():
+    corte = request.args.get("corte") or date.today().isoformat()
+    try:
+        corte = date.fromisoformat(corte).isoformat()
+    except ValueError:
+        corte = date.today().isoformat()
+    try:
+        pagina = max(1, int(request.args.get("pagina", 1)))
+    except ValueError:
+        pagina = 1
+    return {
+        "corte": corte,
+        "tramo": request.args.get("tramo") or "",
+        "socio": (request.args.get("socio") or "").strip(),
+        "solo_vencidos": request.args.get("solo_vencidos") == "1",
+        "incluir_cancelados": request.args.get("incluir_cancelados") == "1",
+        "pagina": pagina,
+    }
+
+
+def _sql_prestamos_filtrados(filtros):
+    """Consulta y parámetros del detalle filtrado (por defecto, sólo con saldo)."""
+    condiciones = []
+    params = {"corte": filtros["corte"]}
+    if not filtros["incluir_cancelados"]:
+        condiciones.append("saldo_pendiente > 0")
+    if filtros["tramo"]:
+        condiciones.append("tramo = :tramo")
+        params["tramo"] = filtros["tramo"]
+    if filtros["solo_vencidos"]:
+        condiciones.append("dias_atraso > 0")
+    if filtros["socio"]:
+        condiciones.append("(instr(lower(numero_socio), :socio) > 0 OR instr(lower(nombre), :socio) > 0)")
+        params["socio"] = filtros["socio"].lower()
+    where = ("WHERE " + " AND ".join(condiciones)) if condiciones else ""
+    return f"SELECT * FROM ({_sql_morosidad()}) {where}", params
+
+
+def pagina_morosidad(filtros):
+    clave = (tenant_actual(), _version_morosidad(), tuple(sorted(filtros.items())))
+    pagina = _cache_morosidad_paginas.get(clave)
+    if pagina is not None:
+        return pagina
+
+    sql, params = _sql_prestamos_filtrados(filtros)
+    conn = db()
+    cur = conn.cursor()
+    # el total sale de la misma consulta (la ventana se evalúa antes del LIMIT)
+    cur.execute(f"""
+        SELECT *, COUNT(*) OVER () AS total_filas FROM ({sql})
+        ORDER BY dias_atraso DESC, numero_socio, id
+        LIMIT :limite OFFSET :desde
+    """, dict(params, limite=MOROSIDAD_POR_PAGINA,
+              desde=(filtros["pagina"] - 1) * MOROSIDAD_POR_PAGINA))
+    filas = [dict(f) for f in cur.fetchall()]
+    if filas:
+        total = filas[0]["total_filas"]
+    else:
+        cur.execute(f"SELECT COUNT(*) FROM ({sql})", params)
+        total = cur.fetchone()[0]
+    conn.close()
+
+    pagina = {
+        "prestamos": filas,
+        "total": total,
+        "numero": filtros["pagina"],
+        "paginas": max(1, -(-total // MOROSIDAD_POR_PAGINA)),
+    }
+    _cache_morosidad_paginas.set(clave, pagina)
+    return pagina
+
+
+def _query_pagina(numero: int) -> str:
+    args = request.args.to_dict()
+    args["pagina"] = numero
+    return urlencode(args)
+
+
+@app.route("/admin/morosidad")
+@admin_required
+def admin_morosidad():
+    filtros = _filtros_morosidad()
+    reporte = reporte_morosidad(filtros["corte"])
+    pagina = pagina_morosidad(filtros)
+    return render_template(
+        "admin_morosidad.html",
+        reporte=reporte,
+        pagina=pagina,
+        prestamos=pagina["prestamos"],
+        filtros=filtros,
+        tramos=TRAMOS_MORA,
+        query_anterior=_query_pagina(pagina["numero"] - 1),
+        query_siguiente=_query_pagina(pagina["numero"] + 1),
+    )
+
+
+@app.route("/admin/morosidad.csv")
+@admin_required
+def admin_morosidad_csv():
+    filtros = _filtros_morosidad()
+    sql, params = _sql_prestamos_filtrados(filtros)
+    # La conexión se abre acá (el tenant se resuelve durante la petición) y
+    # las filas se escriben a medida que se leen, sin cargar toda la cartera.
+    conn = db()
+    cur = conn.cursor()
+    cur.execute(sql + " ORDER BY dias_atraso DESC, numero_socio, id", params)
+
+    def generar():
+        salida = StringIO()
+        w = csv.writer(salida)
+        try:
+            salida.write("\ufeff")
+            w.writerow(["prestamo_id", "numero_socio", "nombre", "fecha_inicio", "fecha_fin",
+                        "monto", "saldo_pendiente", "estado", "ultimo_pago", "dias_atraso",
+                        "tramo", "multas"])
+            while True:
+                filas = cur.fetchmany(500)
+                if not filas:
+                    break
+                for pr in filas:
+                    w.writerow([pr["id"], pr["numero_socio"], pr["nombre"], pr["fecha_inicio"],
+                                pr["fecha_fin"] or "", f"{pr['monto']:.2f}", f"{pr['saldo_pendiente']:.2f}",
+                                pr["estado"] or "", pr["ultimo_pago"] or "", pr["dias_atraso"],
+                                pr["tramo"], f"{pr['multas']:.2f}"])
+                yield salida.getvalue().encode("utf-8")
+                salida.seek(0)
+                salida.truncate()
+            yield salida.getvalue().encode("utf-8")
+        finally:
+            conn.close()
+
+    filename = f"morosidad_{filtros['corte']}.csv"
+    return Response(generar(), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
 # ==============================
 # ADMIN: GESTIÓN DE SOCIOS
 # ==============================
@@ -631,6 +2682,7 @@ def admin_socio_password(socio_id):
             cur.execute("UPDATE socios_web SET password_hash = ? WHERE id = ?", (hash_password(password), socio_id))
             conn.commit()
             conn.close()
+            revocar_sesiones("socio", socio_id)
             return redirect("/admin/socios")
 
     conn = db()
@@ -662,10 +2714,12 @@ def admin_socio_eliminar(socio_id):
     cur.execute("DELETE FROM prestamos WHERE socio_id = ?", (socio_id,))
     cur.execute("DELETE FROM aportes WHERE socio_id = ?", (socio_id,))
     cur.execute("DELETE FROM retiros WHERE socio_id = ?", (socio_id,))
+    cur.execute("DELETE FROM cierres WHERE socio_id = ?", (socio_id,))
     cur.execute("DELETE FROM socios_web WHERE id = ?", (socio_id,))
 
     conn.commit()
     conn.close()
+    revocar_sesiones("socio", socio_id)
     return redirect("/admin/socios")
 
 
@@ -698,13 +2752,19 @@ def admin_aporte_nuevo():
             error = "No existe un socio con ese número."
             return render_template("admin_aporte_nuevo.html", error=error)
         socio_id = row["id"]
-
-        cur.execute("""
-            INSERT INTO aportes (socio_id, fecha, monto, frecuencia)
-            VALUES (?,?,?,?)
-        """, (socio_id, fecha, monto_float, frecuencia))
-        conn.commit()
         conn.close()
+
+        def insertar(c):
+            verificar_periodo_abierto(c, fecha)
+            c.execute("""
+                INSERT INTO aportes (socio_id, fecha, monto, frecuencia)
+                VALUES (?,?,?,?)
+            """, (socio_id, fecha, monto_float, frecuencia))
+
+        try:
+            escribir(insertar)
+        except (PeriodoCerrado, ErrorEscritura) as e:
+            return render_template("admin_aporte_nuevo.html", error=str(e))
         return redirect("/admin/panel")
 
     return render_template("admin_aporte_nuevo.html", error=error)
@@ -735,13 +2795,19 @@ def admin_retiro_nuevo():
             error = "No existe un socio con ese número."
             return render_template("admin_retiro_nuevo.html", error=error)
         socio_id = row["id"]
-
-        cur.execute("""
-            INSERT INTO retiros (socio_id, fecha, monto, motivo)
-            VALUES (?,?,?,?)
-        """, (socio_id, fecha, monto_float, motivo))
-        conn.commit()
         conn.close()
+
+        def insertar(c):
+            verificar_periodo_abierto(c, fecha)
+            c.execute("""
+                INSERT INTO retiros (socio_id, fecha, monto, motivo)
+                VALUES (?,?,?,?)
+            """, (socio_id, fecha, monto_float, motivo))
+
+        try:
+            escribir(insertar)
+        except (PeriodoCerrado, ErrorEscritura) as e:
+            return render_template("admin_retiro_nuevo.html", error=str(e))
         return redirect("/admin/panel")
 
     return render_template("admin_retiro_nuevo.html", error=error)
@@ -776,17 +2842,23 @@ def admin_prestamo_nuevo():
             error = "No existe un socio con ese número."
             return render_template("admin_prestamo_nuevo.html", error=error)
         socio_id = row["id"]
-
-        cur.execute("""
-            INSERT INTO prestamos (
-                socio_id, fecha_inicio, fecha_fin, monto,
-                tasa_interes, tipo_interes, saldo_pendiente, estado
-            )
-            VALUES (?,?,?,?,?,?,?,?)
-        """, (socio_id, fecha_inicio, fecha_fin, monto_float,
-              tasa_float, tipo, monto_float, estado))
-        conn.commit()
         conn.close()
+
+        def insertar(c):
+            verificar_periodo_abierto(c, fecha_inicio)
+            c.execute("""
+                INSERT INTO prestamos (
+                    socio_id, fecha_inicio, fecha_fin, monto,
+                    tasa_interes, tipo_interes, saldo_pendiente, estado
+                )
+                VALUES (?,?,?,?,?,?,?,?)
+            """, (socio_id, fecha_inicio, fecha_fin, monto_float,
+                  tasa_float, tipo, monto_float, estado))
+
+        try:
+            escribir(insertar)
+        except (PeriodoCerrado, ErrorEscritura) as e:
+            return render_template("admin_prestamo_nuevo.html", error=str(e))
         return redirect("/admin/panel")
 
     return render_template("admin_prestamo_nuevo.html", error=error)
@@ -813,24 +2885,35 @@ def admin_pago_nuevo():
         except:
             error = "Montos inválidos."
         else:
-            cur.execute("""
-                INSERT INTO pagos_prestamo
-                (prestamo_id, fecha, monto_principal, monto_interes, monto_multa)
-                VALUES (?,?,?,?,?)
-            """, (prestamo_id, fecha, monto_p_f, monto_i_f, monto_m_f))
-
-            # actualizar saldo
-            cur.execute("SELECT saldo_pendiente FROM prestamos WHERE id = ?", (prestamo_id,))
-            row = cur.fetchone()
-            if row:
+            def registrar_pago(c):
+                verificar_periodo_abierto(c, fecha)
+                # el préstamo se busca dentro del lote: nadie más escribe entre medio
+                c.execute("SELECT saldo_pendiente FROM prestamos WHERE id = ?", (prestamo_id,))
+                row = c.fetchone()
+                if not row:
+                    raise ValueError("No existe el préstamo seleccionado.")
+
+                c.execute("""
+                    INSERT INTO pagos_prestamo
+                    (prestamo_id, fecha, monto_principal, monto_interes, monto_multa)
+                    VALUES (?,?,?,?,?)
+                """, (prestamo_id, fecha, monto_p_f, monto_i_f, monto_m_f))
+
                 saldo = row["saldo_pendiente"] - monto_p_f
                 if saldo < 0:
                     saldo = 0
-                cur.execute("UPDATE prestamos SET saldo_pendiente = ? WHERE id = ?", (saldo, prestamo_id))
+                c.execute("UPDATE prestamos SET saldo_pendiente = ? WHERE id = ?", (saldo, prestamo_id))
 
-            conn.commit()
-            conn.close()
-            return redirect("/admin/panel")
+            try:
+                escribir(registrar_pago)
+            except (ValueError, ErrorEscritura) as e:  # incluye PeriodoCerrado
+                error = str(e)
+            except sqlite3.Error:
+                # la operación se deshizo en su savepoint: no quedó nada escrito
+                error = "No se pudo registrar el pago; no se guardó ningún cambio."
+            else:
+                conn.close()
+                return redirect("/admin/panel")
 
     # GET o error: cargar préstamos
     cur.execute("""
@@ -848,13 +2931,25 @@ def admin_pago_nuevo():
 # BACKUPS
 # ==============================
 
+def respaldar_db() -> str:
+    """Copia consistente (API de backup de SQLite) en la carpeta del tenant."""
+    carpeta = rutas_tenant()["backups"]
+    os.makedirs(carpeta, exist_ok=True)
+    filename = "backup_" + datetime.now().strftime("%Y%m%d_%H%M") + ".db"
+    backup_path = os.path.join(carpeta, filename)
+    destino = sqlite3.connect(backup_path)
+    conn = db()
+    conn.backup(destino)
+    conn.close()
+    destino.close()
+    return backup_path
+
+
 @app.route("/admin/backup_db")
 @admin_required
 def backup_db():
     try:
-        filename = "backup_" + datetime.now().strftime("%Y%m%d_%H%M") + ".db"
-        backup_path = os.path.join(BACKUP_DIR, filename)
-        shutil.copy(DATABASE, backup_path)
+        backup_path = respaldar_db()
         return send_file(backup_path, as_attachment=True)
     except Exception as e:
         return f"Error generando backup: {str(e)}"
@@ -872,9 +2967,18 @@ def admin_restore():
             msg_error = "Debe seleccionar un archivo .db válido."
         else:
             try:
-                temp_path = os.path.join(BACKUP_DIR, "restore_temp.db")
+                carpeta = rutas_tenant()["backups"]
+                os.makedirs(carpeta, exist_ok=True)
+                temp_path = os.path.join(carpeta, "restore_temp.db")
                 file.save(temp_path)
-                shutil.copy(temp_path, DATABASE)
+                # API de backup: las conexiones del pool siguen siendo válidas
+                origen = sqlite3.connect(temp_path)
+                conn = db()
+                origen.backup(conn)
+                conn.close()
+                origen.close()
+                inicializar_db()
+                nueva_epoca_datos()
                 msg_ok = "Restauración completada correctamente."
             except Exception as e:
                 msg_error = f"Error al restaurar: {str(e)}"
@@ -882,10 +2986,98 @@ def admin_restore():
     return render_template("admin_restore.html", error=msg_error, success=msg_ok)
 
 
+# ==============================
+# COMANDOS CLI
+# ==============================
+
+@app.cli.command("assets")
+def assets_cmd():
+    """Regenera los assets con huella y sus variantes .gz."""
+    manifiesto = construir_assets()
+    for origen, destino in manifiesto.items():
+        click.echo(f"{origen} -> {destino}")
+
+
+@app.cli.command("cerrar-periodo")
+@click.argument("periodo")
+def cerrar_periodo_cmd(periodo):
+    """Cierra el mes AAAA-MM (snapshot de saldos por socio)."""
+    try:
+        socios = cerrar_periodo(periodo)
+    except (ValueError, ErrorEscritura) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Período {periodo} cerrado ({socios} socios).")
+
+
+@app.cli.command("crear-tenant")
+@click.argument("nombre")
+def crear_tenant_cmd(nombre):
+    """Crea la carpeta y la base de una cooperativa nueva."""
+    if not TENANT_NOMBRE_RE.match(nombre):
+        raise click.BadParameter("use minúsculas, dígitos y guiones (máx. 40).")
+    os.makedirs(rutas_tenant(nombre)["backups"], exist_ok=True)
+    en_tenant(nombre, inicializar_db)
+    click.echo(f"Tenant {nombre} creado en {rutas_tenant(nombre)['db']}")
+
+
+@app.cli.command("migrar-tenants")
+def migrar_tenants_cmd():
+    """Aplica el esquema actual a la base de cada tenant."""
+    for tenant in en_todos_los_tenants(inicializar_db):
+        click.echo(f"{tenant}: ok")
+
+
+@app.cli.command("backup-tenants")
+def backup_tenants_cmd():
+    """Respalda todas las bases de tenants en paralelo."""
+    for tenant, ruta in en_todos_los_tenants(respaldar_db).items():
+        click.echo(f"{tenant}: {ruta}")
+
+
+def _resumen_global_tenant(corte: str):
+    resumen = resumen_cooperativa()
+    morosidad = reporte_morosidad(corte)
+    resumen["cartera"] = morosidad["cartera"]
+    resumen["par30"] = morosidad["par"][30]
+    resumen["multas"] = morosidad["multas_total"]
+    return resumen
+
+
+@app.cli.command("reporte-tenants")
+@click.option("--corte", default=None, help="Fecha de corte (AAAA-MM-DD), por defecto hoy.")
+def reporte_tenants_cmd(corte):
+    """Reporte agregado de todas las cooperativas (consulta cada base en paralelo)."""
+    corte = corte or date.today().isoformat()
+    resultados = en_todos_los_tenants(_resumen_global_tenant, corte)
+    click.echo(f"{'tenant':<20}{'socios':>8}{'aportes':>14}{'retiros':>14}{'cartera':>14}{'PAR30':>8}")
+    totales = {"total_socios": 0, "total_aportes": 0.0, "total_retiros": 0.0, "cartera": 0.0}
+    for tenant, r in resultados.items():
+        click.echo(f"{tenant:<20}{r['total_socios']:>8}{r['total_aportes']:>14.2f}"
+                   f"{r['total_retiros']:>14.2f}{r['cartera']:>14.2f}{r['par30'] * 100:>7.1f}%")
+        for k in totales:
+            totales[k] += r[k]
+    click.echo(f"{'TOTAL':<20}{totales['total_socios']:>8}{totales['total_aportes']:>14.2f}"
+               f"{totales['total_retiros']:>14.2f}{totales['cartera']:>14.2f}")
+
+
+@app.cli.command("calibrar-hash")
+@click.option("--objetivo-ms", default=100.0, help="Tiempo objetivo por login en milisegundos.")
+@click.option("--r", "r", default=8)
+@click.option("--p", "p", default=1)
+def calibrar_hash_cmd(objetivo_ms, r, p):
+    """Mide scrypt en esta máquina y sugiere parámetros."""
+    res = calibrar_scrypt(objetivo_ms, r, p)
+    click.echo(f"n={res['n']} r={res['r']} p={res['p']} ({res['ms']:.1f} ms)")
+    click.echo(f"export COOP_SCRYPT_N={res['n']} COOP_SCRYPT_R={res['r']} COOP_SCRYPT_P={res['p']}")
+
+
 # ==============================
 # INICIO
 # ==============================
 
+# Importar el módulo no toca ninguna base: cada una (la principal o la de
+# un tenant) se migra al abrir su pool, con la primera petición que la usa.
 if __name__ == "__main__":
-    inicializar_db()
+    if not TENANT_MODO:
+        db().close()
     app.run(debug=True)
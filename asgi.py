@@ -0,0 +1,13 @@
+# Punto de entrada ASGI para servidores como uvicorn. La app es WSGI y
+# síncrona: cada petición corre en un hilo de un pool de COOP_ASGI_HILOS,
+# así una petición lenta (p. ej. el scrypt del login) no frena a las demás.
+#   uvicorn asgi:asgi_app --workers 2
+# Con gunicorn no hace falta este archivo; usar workers con hilos:
+#   gunicorn --worker-class gthread --workers 2 --threads 8 app:app
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import app
+
+asgi_app = WSGIMiddleware(app, workers=int(os.environ.get("COOP_ASGI_HILOS", 8)))